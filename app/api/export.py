@@ -0,0 +1,242 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+from app.db.migrations import LENIENT_TO_DATE_STAGE, timestamps_migrated
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Documents per round trip, per CSV chunk and per Arrow record batch or
+# Parquet row group
+EXPORT_BATCH_SIZE = 10000
+
+FORMATS = ("csv", "parquet", "arrow", "bson")
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "bson": "application/bson",
+}
+
+
+def _timestamp(value):
+    # Timestamps not migrated to dates yet are ISO strings
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _tags(value):
+    return [value] if isinstance(value, str) else [str(tag) for tag in value]
+
+
+# Conversion of the values of each arrow type. Values that can't be
+# converted are exported as nulls
+CONVERSIONS = {
+    "string": str,
+    "int64": int,
+    "float64": float,
+    "timestamp": _timestamp,
+    "strings": _tags,
+}
+
+# Exported columns: name, field of the document and arrow type
+COLUMNS = {
+    "payments": [
+        ("_id", "_id", "string"),
+        ("offer_id", "offer_id", "int64"),
+        ("amount", "amount", "float64"),
+        ("nationality", "nationality", "string"),
+        ("timestamp", "timestamp", "timestamp"),
+        ("userid", "offer.userid", "string"),
+    ],
+    "offers": [
+        ("_id", "_id", "string"),
+        ("id", "id", "int64"),
+        ("userid", "userid", "string"),
+        ("name", "name", "string"),
+        ("price", "price", "float64"),
+        ("tags", "tags", "strings"),
+        ("timestamp", "timestamp", "timestamp"),
+    ],
+}
+
+
+def _arrow_type(name: str):
+    if name == "timestamp":
+        return pyarrow.timestamp("ms")
+    if name == "strings":
+        return pyarrow.list_(pyarrow.string())
+    return getattr(pyarrow, name)()
+
+
+def _value(document, path: str):
+    for field in path.split("."):
+        if document is None:
+            return None
+        document = document.get(field)
+    return document
+
+
+def _rows(documents: Iterable[RawBSONDocument], columns) -> Iterator[List[Any]]:
+    for document in documents:
+        row = []
+        for name, path, arrow_type in columns:
+            value = _value(document, path)
+            if value is not None:
+                try:
+                    value = CONVERSIONS[arrow_type](value)
+                except (TypeError, ValueError, OverflowError):
+                    logger.warning(f"Exporting {name} {value!r} of document {document.get('_id')} as null")
+                    value = None
+            row.append(value)
+        yield row
+
+
+async def _batches(cursor, size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list]:
+    while True:
+        batch = await cursor.to_list(size)
+        if not batch:
+            return
+        yield batch
+
+
+class _Chunks(io.RawIOBase):
+    """
+    Write-only file whose content is taken out after each batch, so the
+    Arrow and Parquet writers can stream into the response.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def take(self) -> bytes:
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+
+async def _csv(batches, columns) -> AsyncIterator[bytes]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([name for name, _, _ in columns])
+    async for batch in batches:
+        for row in _rows(batch, columns):
+            writer.writerow(
+                "|".join(value) if isinstance(value, list)
+                else value.isoformat() if isinstance(value, datetime)
+                else value
+                for value in row
+            )
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode()
+
+
+async def _arrow(batches, columns, parquet: bool) -> AsyncIterator[bytes]:
+    types = [_arrow_type(arrow_type) for _, _, arrow_type in columns]
+    schema = pyarrow.schema([(name, arrow_type) for (name, _, _), arrow_type in zip(columns, types)])
+    sink = _Chunks()
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+
+    async for batch in batches:
+        rows = list(_rows(batch, columns))
+        arrays = [pyarrow.array(values, type=arrow_type) for values, arrow_type in zip(zip(*rows), types)]
+        record_batch = pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+        if parquet:
+            # One row group per batch
+            writer.write_table(pyarrow.Table.from_batches([record_batch]))
+        else:
+            writer.write_batch(record_batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+async def _bson(batches) -> AsyncIterator[bytes]:
+    # The documents as stored, concatenated like a mongodump file
+    async for batch in batches:
+        yield b"".join(document.raw for document in batch)
+
+
+async def _gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def export_response(collection, dataset: str, format: str, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None, gzip: bool = False) -> StreamingResponse:
+    """
+    Streams the documents of `collection` with a timestamp in the range as
+    a file of `format`. Documents are read as RawBSONDocument with only the
+    exported fields, and are passed through undecoded for bson, except for
+    the timestamps of a range of a collection not migrated to dates yet.
+    """
+    if format in ("parquet", "arrow") and pyarrow is None:
+        raise HTTPException(status_code=501, detail="Parquet and Arrow exports need pyarrow to be installed")
+
+    query: Dict[str, Any] = {}
+    if since is not None or until is not None:
+        query["timestamp"] = {}
+        if since is not None:
+            query["timestamp"]["$gte"] = since
+        if until is not None:
+            query["timestamp"]["$lt"] = until
+
+    columns = COLUMNS[dataset]
+    projection = None if format == "bson" else {path: 1 for _, path, _ in columns}
+    raw = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+    if query and not await timestamps_migrated(collection):
+        # Timestamps not migrated to dates yet are compared as dates
+        pipeline = [LENIENT_TO_DATE_STAGE, {"$match": query}]
+        if projection:
+            pipeline.append({"$project": projection})
+        cursor = raw.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE)
+    else:
+        cursor = raw.find(query, projection, batch_size=EXPORT_BATCH_SIZE)
+
+    batches = _batches(cursor)
+    if format == "bson":
+        chunks = _bson(batches)
+    elif format == "csv":
+        chunks = _csv(batches, columns)
+    else:
+        chunks = _arrow(batches, columns, parquet=format == "parquet")
+
+    filename = f"{dataset}.{format}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        chunks = _gzip(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        chunks, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,165 @@
+from collections import namedtuple
+from datetime import datetime
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.api.series import METRICS
+from app.core.buckets import STEPS, calendar, label
+from app.core.scopes import provider_scope
+from app.db import rollups
+from app.db.repository import repository
+
+# Forecasts of a batch of series, arrays of shape (series, horizon)
+Forecast = namedtuple("Forecast", "mean lower upper")
+
+METHODS = ("linear", "holt")
+DEFAULT_HORIZON = 3
+MAX_HORIZON = 24
+DEFAULT_LEVEL = 0.95
+
+# Smoothing parameters tried for every series, the pair with the lowest
+# one-step-ahead error is kept per series
+HOLT_ALPHAS = np.linspace(0.1, 0.9, 9)
+HOLT_BETAS = np.array([0.01, 0.05, 0.1, 0.2, 0.3, 0.5])
+
+
+def _z(level: float) -> float:
+    return NormalDist().inv_cdf((1 + level) / 2)
+
+
+def _matrix(values) -> np.ndarray:
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    if values.shape[1] < 3:
+        raise ValueError("Forecasts need at least 3 points per series")
+    return values
+
+
+def linear(values, horizon: int = DEFAULT_HORIZON, level: float = DEFAULT_LEVEL) -> Forecast:
+    """
+    Least squares line through every point of each series, solved for all
+    the series at once, with the prediction interval of the fit.
+    """
+    values = _matrix(values)
+    points = values.shape[1]
+    t = np.arange(points, dtype=float)
+    design = np.column_stack([np.ones(points), t])
+    coefficients = np.linalg.lstsq(design, values.T, rcond=None)[0]
+
+    residuals = values - (design @ coefficients).T
+    sigma = np.sqrt((residuals ** 2).sum(axis=1) / max(points - 2, 1))
+
+    future = np.arange(points, points + horizon, dtype=float)
+    mean = coefficients[0][:, None] + coefficients[1][:, None] * future
+    spread = np.sqrt(1 + 1 / points + (future - t.mean()) ** 2 / ((t - t.mean()) ** 2).sum())
+    margin = _z(level) * sigma[:, None] * spread
+    return Forecast(mean, mean - margin, mean + margin)
+
+
+def holt(values, horizon: int = DEFAULT_HORIZON, level: float = DEFAULT_LEVEL) -> Forecast:
+    """
+    Holt's linear exponential smoothing. Every pair of smoothing parameters
+    runs over all the series in the same pass, one step per point.
+    """
+    values = _matrix(values)
+    series, points = values.shape
+    alphas, betas = (grid.ravel()[:, None] for grid in np.meshgrid(HOLT_ALPHAS, HOLT_BETAS))
+
+    smoothed = np.broadcast_to(values[:, 0], (len(alphas), series)).copy()
+    trend = np.broadcast_to(values[:, 1] - values[:, 0], (len(alphas), series)).copy()
+    sse = np.zeros_like(smoothed)
+    for point in range(1, points):
+        error = values[:, point] - (smoothed + trend)
+        sse += error ** 2
+        smoothed = smoothed + trend + alphas * error
+        trend = trend + alphas * betas * error
+
+    best = sse.argmin(axis=0)
+    columns = np.arange(series)
+    alpha, beta = alphas[best, 0], betas[best, 0]
+    sigma = np.sqrt(sse[best, columns] / max(points - 3, 1))
+
+    steps = np.arange(1, horizon + 1)
+    mean = smoothed[best, columns][:, None] + trend[best, columns][:, None] * steps
+    # Variance of the h-step error of the additive trend model
+    weights = (alpha[:, None] * (1 + np.arange(horizon) * beta[:, None])) ** 2
+    weights[:, 0] = 1
+    margin = _z(level) * sigma[:, None] * np.sqrt(np.cumsum(weights, axis=1))
+    return Forecast(mean, mean - margin, mean + margin)
+
+
+def trend_regressor(slope: float, b: float, horizon: int = DEFAULT_HORIZON) -> np.ndarray:
+    """
+    Google Trends adjustment of each step: the signed log of the trend line
+    fitted on its last points, 3 steps from its origin at the first step.
+    """
+    trend = slope * np.arange(3, 3 + horizon) + b
+    return np.sign(trend) * np.log(np.maximum(np.abs(trend), 1e-12))
+
+
+def forecast(values, horizon: int = DEFAULT_HORIZON, method: str = "linear", regressor=None,
+             level: float = DEFAULT_LEVEL) -> Forecast:
+    """
+    Forecasts the next `horizon` points of each row of `values`, with
+    bands at the confidence `level`. `regressor`, of shape (horizon,) or
+    (series, horizon), is added to the forecasts.
+    """
+    if method not in METHODS:
+        raise KeyError(method)
+    result = (holt if method == "holt" else linear)(values, horizon, level)
+    if regressor is None:
+        return result
+    regressor = np.asarray(regressor, dtype=float)
+    return Forecast(*(array + regressor for array in result))
+
+
+def future_labels(granularity: str, horizon: int, now: Optional[datetime] = None) -> List[str]:
+    last = calendar(granularity, now, size=1)[0]
+    return [label(last + STEPS[granularity] * step, granularity) for step in range(1, horizon + 1)]
+
+
+def _predictions(values, granularity, horizon, method, trend, now) -> List[List[Dict[str, Any]]]:
+    regressor = trend_regressor(*trend, horizon) if trend is not None else None
+    # Counts and profits are never negative
+    mean, lower, upper = (np.maximum(array, 0) for array in forecast(values, horizon, method, regressor))
+    labels = future_labels(granularity, horizon, now)
+    return [
+        [
+            {"date": date, "count": float(count), "lower": float(low), "upper": float(high)}
+            for date, count, low, high in zip(labels, *row)
+        ]
+        for row in zip(mean, lower, upper)
+    ]
+
+
+def prediction(series: Sequence[Dict[str, Any]], granularity: str, horizon: int = DEFAULT_HORIZON,
+               method: str = "linear", trend: Optional[Tuple[float, float]] = None,
+               now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    The /prediction response of an /analysis series: the forecast count of
+    each of the next `horizon` buckets and its bands.
+    """
+    return _predictions([[point["count"] for point in series]], granularity, horizon, method, trend, now)[0]
+
+
+async def provider_predictions(metric: str, granularity: str, horizon: int = DEFAULT_HORIZON, method: str = "linear",
+                         trend: Optional[Tuple[float, float]] = None,
+                         now: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    The /prediction responses of every provider with payments in the window
+    of a rolled up metric, from one query and one forecast of all their
+    series.
+    """
+    if "rollup" not in METRICS[metric] or granularity not in rollups.GRANULARITIES:
+        raise KeyError((metric, granularity))
+    # Each provider's forecast is computed from its series when requested
+    if not await rollups.rollups_built(repository.rollups):
+        return {}
+    prefix = provider_scope("")
+    _, series = await rollups.rollup_matrix(repository.rollups, prefix, granularity, METRICS[metric]["rollup"], now)
+    if not series:
+        return {}
+    scopes = list(series)
+    responses = _predictions([series[scope] for scope in scopes], granularity, horizon, method, trend, now)
+    return {scope[len(prefix):]: response for scope, response in zip(scopes, responses)}
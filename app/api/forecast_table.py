@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+from pymongo import ReplaceOne
+
+from app.api.forecast import MAX_HORIZON, METHODS, prediction, provider_predictions
+from app.api.series import get_series
+from app.api.trends import trends_store
+from app.core.buckets import calendar
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.scopes import GLOBAL_SCOPE, provider_scope
+from app.db.repository import repository
+
+# Stored forecasts, one document per (scope, granularity, metric) with the
+# next MAX_HORIZON buckets of every method: a shorter horizon is a prefix.
+# A document is only served while the current bucket is the one it was
+# computed in, as its dates start at the next one.
+WRITE_BATCH_SIZE = 500
+
+
+def forecast_id(scope: str, granularity: str, metric: str) -> str:
+    return f"{scope}:{granularity}:{metric}"
+
+
+def _trend(granularity: str) -> Tuple[float, float]:
+    return trends_store.get(settings.TRENDS_SEARCH_TERM, "months" if granularity == "month" else "days")
+
+
+def _document(scope, granularity, metric, predictions, now, generated_at) -> Dict[str, Any]:
+    return {
+        "_id": forecast_id(scope, granularity, metric),
+        "scope": scope,
+        "granularity": granularity,
+        "metric": metric,
+        "bucket": calendar(granularity, now, size=1)[0],
+        "generated_at": generated_at,
+        "predictions": predictions,
+    }
+
+
+def _forecasts(series, granularity, now) -> Dict[str, List[Dict[str, Any]]]:
+    trend = _trend(granularity)
+    return {method: prediction(series, granularity, MAX_HORIZON, method, trend, now) for method in METHODS}
+
+
+async def refresh_forecasts(dmo_series: Iterable[Tuple[str, str]], provider_series: Iterable[Tuple[str, str]],
+                            collection=None, now: Optional[datetime] = None) -> int:
+    """
+    Computes and stores the forecasts of the (granularity, metric) series
+    of the DMO and of every provider, those of the providers in one pass
+    per series and method. Returns the number of forecasts stored.
+    """
+    collection = repository.forecasts if collection is None else collection
+    now = now or datetime.now()
+    generated_at = datetime.utcnow()
+
+    dmo_series = list(dmo_series)
+    values = await asyncio.gather(*(get_series(y, x, now=now) for x, y in dmo_series))
+    documents = [
+        _document(GLOBAL_SCOPE, x, y, _forecasts(series, x, now), now, generated_at)
+        for (x, y), series in zip(dmo_series, values)
+    ]
+    for x, y in provider_series:
+        trend = _trend(x)
+        predictions = await asyncio.gather(
+            *(provider_predictions(y, x, MAX_HORIZON, method, trend, now) for method in METHODS)
+        )
+        by_method = dict(zip(METHODS, predictions))
+        documents.extend(
+            _document(provider_scope(userid), x, y, {method: by_method[method][userid] for method in METHODS},
+                      now, generated_at)
+            for userid in by_method[METHODS[0]]
+        )
+
+    for start in range(0, len(documents), WRITE_BATCH_SIZE):
+        await collection.bulk_write(
+            [ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+             for document in documents[start:start + WRITE_BATCH_SIZE]],
+            ordered=False,
+        )
+    return len(documents)
+
+
+async def stored_prediction(scope: str, granularity: str, metric: str, horizon: int, method: str,
+                            series: Callable[[], Awaitable[List[Dict[str, Any]]]], refresh: bool = False,
+                            collection=None, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    The /prediction response from the stored forecast of the series. It is
+    computed from `series` and stored when missing, out of date or when
+    `refresh` is set.
+    """
+    collection = repository.forecasts if collection is None else collection
+    bucket = calendar(granularity, now, size=1)[0]
+    if not refresh:
+        document = await collection.find_one(
+            {"_id": forecast_id(scope, granularity, metric), "bucket": bucket},
+            {f"predictions.{method}": 1},
+        )
+        if document is not None:
+            metrics.incr("forecasts.hits")
+            return document["predictions"][method][:horizon]
+    metrics.incr("forecasts.misses")
+
+    predictions = _forecasts(await series(), granularity, now)
+    document = _document(scope, granularity, metric, predictions, now, datetime.utcnow())
+    await collection.replace_one({"_id": document["_id"]}, document, upsert=True)
+    return predictions[method][:horizon]
+
+
+async def run(interval: float, dmo_series, provider_series):
+    """
+    Refreshes the stored forecasts every `interval` seconds, until cancelled.
+    """
+    while True:
+        try:
+            with metrics.timer("forecasts.refresh"):
+                stored = await refresh_forecasts(dmo_series, provider_series)
+            logger.info(f"Stored {stored} forecasts")
+        except Exception as e:
+            # Retried at the next interval, stored forecasts are still served
+            metrics.incr("forecasts.errors")
+            logger.error(f"Could not refresh the forecasts: {e}")
+        await asyncio.sleep(interval)
@@ -26,10 +26,7 @@ def get_trends(seacrh_term: str, date: str):
 
 #     return trends
 
-def get_slope_and_b_of_trend_last_3_days(search_term: str):
-    trends = get_trends(search_term, "today 1-m")
-    values = trends["interest_over_time"]["timeline_data"]
-
+def slope_and_b_last_3_days(values):
     # Calculate the slopes and b values
     slope1 = values[-2]['values'][0]['extracted_value'] - values[-3]['values'][0]['extracted_value']
 
@@ -45,10 +42,7 @@ def get_slope_and_b_of_trend_last_3_days(search_term: str):
 
     return average_slope, average_b
 
-def get_slope_and_b_of_trend_last_3_months(search_term: str):
-    trends = get_trends(search_term, "today 3-m")
-    values = trends["interest_over_time"]["timeline_data"]
-
+def slope_and_b_last_3_months(values):
     monthly_totals = defaultdict(int)
     monthly_counts = defaultdict(int)
 
@@ -0,0 +1,137 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Literal, Optional
+
+from bson import json_util
+from bson.errors import InvalidBSON
+from fastapi import HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+
+from app.core.responses import MongoJSONResponse, dumps
+from app.db.migrations import LENIENT_TO_DATE_STAGE, timestamps_migrated
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Documents fetched per round trip while streaming
+STREAM_BATCH_SIZE = 1000
+
+
+class PageParams:
+    """
+    Query parameters of the listing endpoints. Pages are sorted by `sort`
+    with _id breaking ties, and `cursor` is the X-Next-Cursor header of the
+    previous page. With format=ndjson every matching document from
+    `cursor` on is streamed, one JSON document per line.
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        sort: Literal["_id", "timestamp"] = "_id",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        format: Literal["json", "ndjson"] = "json",
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.sort = sort
+        self.since = since
+        self.until = until
+        self.format = format
+
+
+def encode_cursor(document: Dict[str, Any], sort: str) -> str:
+    key = [document["_id"]] if sort == "_id" else [document.get("timestamp"), document["_id"]]
+    return base64.urlsafe_b64encode(json_util.dumps({"sort": sort, "key": key}).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> list:
+    try:
+        decoded = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, InvalidBSON):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(decoded, dict) or decoded.get("sort") != sort:
+        raise HTTPException(status_code=400, detail="Cursor of a different sort order")
+    return decoded["key"]
+
+
+def page_filter(query: Dict[str, Any], params: PageParams) -> Dict[str, Any]:
+    conditions = [query] if query else []
+
+    time_range = {}
+    if params.since is not None:
+        time_range["$gte"] = params.since
+    if params.until is not None:
+        time_range["$lt"] = params.until
+    if time_range:
+        conditions.append({"timestamp": time_range})
+
+    if params.cursor is not None:
+        key = decode_cursor(params.cursor, params.sort)
+        if params.sort == "_id":
+            conditions.append({"_id": {"$gt": key[0]}})
+        else:
+            timestamp, last_id = key
+            conditions.append({"$or": [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": last_id}},
+            ]})
+
+    if not conditions:
+        return {}
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+async def _lines(cursor) -> AsyncIterator[bytes]:
+    async for document in cursor:
+        yield dumps(document) + b"\n"
+
+
+def _converted(collection, query, projection, params, sort, limit):
+    # Timestamps not migrated to dates yet are compared and sorted as dates,
+    # those that aren't dates have no place in the order and are left out.
+    # The query goes first, so it can still use the indexes
+    pipeline = [{"$match": query}] if query else []
+    pipeline.extend([
+        LENIENT_TO_DATE_STAGE,
+        {"$match": {"timestamp": {"$type": "date"}}},
+        {"$match": page_filter({}, params)},
+        {"$sort": dict(sort)},
+    ])
+    if limit:
+        pipeline.append({"$limit": limit})
+    if projection:
+        pipeline.append({"$project": projection})
+    return collection.aggregate(pipeline, allowDiskUse=True, batchSize=STREAM_BATCH_SIZE)
+
+
+async def paginate(collection, query: Dict[str, Any], projection: Optional[Dict[str, Any]], params: PageParams) -> Response:
+    """
+    The documents of `collection` matching `query` selected by `params`,
+    as a page with the cursor of the next one in the X-Next-Cursor header,
+    or streamed as NDJSON.
+    """
+    sort = [("_id", 1)] if params.sort == "_id" else [("timestamp", 1), ("_id", 1)]
+    # One more than the page size tells whether there is a next page
+    limit = params.limit + 1 if params.format == "json" else None
+
+    by_timestamp = params.sort == "timestamp" or params.since is not None or params.until is not None
+    if by_timestamp and not await timestamps_migrated(collection):
+        cursor = _converted(collection, query, projection, params, sort, limit)
+    else:
+        cursor = collection.find(page_filter(query, params), projection, sort=sort)
+        cursor = cursor.batch_size(STREAM_BATCH_SIZE) if limit is None else cursor.limit(limit)
+
+    if params.format == "ndjson":
+        return StreamingResponse(_lines(cursor), media_type="application/x-ndjson")
+
+    documents = await cursor.to_list(None)
+    headers = {}
+    if len(documents) > params.limit:
+        documents = documents[:params.limit]
+        headers["X-Next-Cursor"] = encode_cursor(documents[-1], params.sort)
+
+    return MongoJSONResponse(documents, headers=headers)
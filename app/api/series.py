@@ -0,0 +1,128 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.buckets import GRANULARITIES, STEPS, calendar, fill, trunc_expression
+from app.core.scopes import GLOBAL_SCOPE, provider_scope
+from app.db import rollups
+from app.db.migrations import timestamp_stages
+from app.db.offer_index import count_offers_first_seen_before
+from app.db.provider_offers import provider_offers
+from app.db.repository import repository
+from app.db.rollups import rollup_totals, rollups_built
+
+# Metrics of the /analysis series. Payment metrics are computed per bucket
+# of the payment timestamps, offer metrics per bucket of the first time an
+# offer was seen. Metrics with a `rollup` field are read from the payment
+# rollups instead of the payments when every requested metric has one, the
+# granularity is rolled up and the rollups were built.
+METRICS: Dict[str, Dict[str, Any]] = {
+    "num_payments": {"source": "payments", "accumulator": {"$sum": 1}, "rollup": "count"},
+    "profit": {"source": "payments", "accumulator": {"$sum": "$amount"}, "rollup": "amount"},
+    "distinct_offers": {"source": "payments", "accumulator": {"$addToSet": "$offer_id"}},
+    "new_offers": {"source": "offers", "accumulator": {"$sum": 1}},
+    # Offers first seen before the end of each bucket
+    "total_offers": {"source": "offers", "cumulative": True},
+}
+
+# Time field of the collection behind each source
+SOURCES = {"payments": "timestamp", "offers": "first_seen"}
+
+
+async def bucket_pipeline(source: str, metrics: Iterable[str], granularity: str, first: datetime, end: datetime,
+                    userid: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    A single pipeline computing every metric of `source` per bucket, from
+    one scan of the documents between `first` and `end`.
+    """
+    time_field = SOURCES[source]
+    pipeline = []
+    if source == "payments":
+        if userid is not None:
+            pipeline.append(await provider_offers.match(repository.offers_current, userid))
+        pipeline.extend(await timestamp_stages(repository.payments))
+    elif userid is not None:
+        pipeline.append({"$match": {"userid": userid}})
+    pipeline.append({"$match": {time_field: {"$gte": first, "$lt": end}}})
+    pipeline.append({"$group": {
+        "_id": trunc_expression(time_field, granularity),
+        **{metric: METRICS[metric]["accumulator"] for metric in metrics},
+    }})
+    return pipeline
+
+
+async def _bucket_values(source, metrics, granularity, buckets, userid) -> Dict[str, Dict[datetime, Any]]:
+    values = defaultdict(dict)
+    if not metrics:
+        return values
+
+    # Payment counts and profit are already summed per bucket in the rollups
+    if source == "payments" and granularity in rollups.GRANULARITIES \
+            and all("rollup" in METRICS[metric] for metric in metrics) \
+            and await rollups_built(repository.rollups):
+        scope = GLOBAL_SCOPE if userid is None else provider_scope(userid)
+        fields = {metric: METRICS[metric]["rollup"] for metric in metrics}
+        totals = await rollup_totals(repository.rollups, scope, granularity, buckets[0], buckets[-1], fields.values())
+        for bucket, rollup in totals.items():
+            for metric, field in fields.items():
+                values[metric][bucket] = rollup.get(field, 0)
+        return values
+
+    collection = repository.payments if source == "payments" else repository.offers_current
+    end = buckets[-1] + STEPS[granularity]
+    pipeline = await bucket_pipeline(source, metrics, granularity, buckets[0], end, userid)
+    async for row in collection.aggregate(pipeline):
+        for metric in metrics:
+            value = row[metric]
+            values[metric][row["_id"]] = len(value) if isinstance(value, list) else value
+    return values
+
+
+async def analysis_series(metrics: Iterable[str], granularity: str, userid: Optional[str] = None,
+                    now: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    The /analysis series of each of `metrics` over the last buckets of
+    `granularity`, for the offers and payments of provider `userid` or of
+    everyone. Metrics of the same collection are computed together, and the
+    collections concurrently.
+    """
+    metrics = list(metrics)
+    buckets = calendar(granularity, now)
+
+    cumulative = any(METRICS[metric].get("cumulative") for metric in metrics)
+    queries = [
+        _bucket_values(source, [
+            metric for metric in metrics
+            if METRICS[metric]["source"] == source and not METRICS[metric].get("cumulative")
+        ], granularity, buckets, userid)
+        for source in SOURCES
+    ]
+    if cumulative:
+        query = None if userid is None else {"userid": userid}
+        boundaries = [bucket + STEPS[granularity] for bucket in buckets]
+        queries.append(count_offers_first_seen_before(repository.offers_current, boundaries, query))
+
+    results = await asyncio.gather(*queries)
+    values = {}
+    for source_values in results[:len(SOURCES)]:
+        values.update(source_values)
+    totals = results[-1] if cumulative else None
+
+    series = {}
+    for metric in metrics:
+        if METRICS[metric].get("cumulative"):
+            series[metric] = fill(buckets, granularity, dict(zip(buckets, totals)))
+        else:
+            series[metric] = fill(buckets, granularity, values.get(metric, {}))
+    return series
+
+
+async def get_series(metric: str, granularity: str, userid: Optional[str] = None, now: Optional[datetime] = None):
+    """
+    The /analysis series of a single metric, raises KeyError for unknown
+    metrics and granularities.
+    """
+    if metric not in METRICS or granularity not in GRANULARITIES:
+        raise KeyError((granularity, metric))
+    return (await analysis_series([metric], granularity, userid, now))[metric]
@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from dateutil.relativedelta import relativedelta
+
+from app.db.migrations import timestamp_stages
+from app.db.provider_offers import provider_offers
+from app.db.repository import aggregate, repository
+
+# KPI cards of the dashboards. Each card is a pipeline over the payments
+# or over offers_current, the lower bound of the timestamps it needs (None
+# for all of them) and a function turning its output into the response of
+# the card's own endpoint. Responses hold
+# BSON values, to be returned with MongoJSONResponse.
+DMO_CARDS = (
+    "profit_this_month", "profit_comparison_with_previous_month",
+    "number_of_sales_this_month", "number_of_sales_comparison_with_previous_month",
+    "most_consumed_tags", "last_payments", "number_of_payments_by_nationality",
+    "total_number_of_offers", "new_offers_this_month", "number_of_offers_by_tag",
+)
+
+PROVIDER_CARDS = (
+    "profit_this_month", "profit_comparison_with_previous_month",
+    "number_of_sales_this_month", "number_of_sales_comparison_with_previous_month",
+    "most_consumed_tags", "last_payments", "number_of_payments_by_nationality",
+    "number_of_offers",
+)
+
+
+def _difference(rows):
+    return rows[0]["this_month"] - rows[0]["last_month"] if rows else 0
+
+
+def _total(rows):
+    return rows[0]["total"] if rows else 0
+
+
+def payment_cards(now: datetime) -> Dict[str, tuple]:
+    this_month = datetime(now.year, now.month, 1)
+    last_month = this_month - relativedelta(months=1)
+    since_this_month = {"$match": {"timestamp": {"$gte": this_month}}}
+    in_this_month = {"$gte": ["$timestamp", this_month]}
+
+    def comparison(value):
+        # Both months from the same documents instead of one scan each
+        return [
+            {"$match": {"timestamp": {"$gte": last_month}}},
+            {"$group": {
+                "_id": None,
+                "this_month": {"$sum": {"$cond": [in_this_month, value, 0]}},
+                "last_month": {"$sum": {"$cond": [in_this_month, 0, value]}},
+            }},
+        ]
+
+    return {
+        "profit_this_month": ([
+            since_this_month,
+            {"$group": {"_id": None, "profit": {"$sum": "$amount"}}},
+            {"$project": {"_id": 0}},
+        ], this_month, list),
+        "profit_comparison_with_previous_month": (comparison("$amount"), last_month, _difference),
+        "number_of_sales_this_month": ([since_this_month, {"$count": "total"}], this_month, list),
+        "number_of_sales_comparison_with_previous_month": (comparison(1), last_month, _difference),
+        "most_consumed_tags": ([
+            {"$unwind": "$offer.tags"},
+            {"$group": {"_id": "$offer.tags", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 2},
+        ], None, lambda rows: [row["_id"] for row in rows]),
+        "last_payments": ([
+            {"$sort": {"timestamp": -1}},
+            {"$limit": 5},
+            {"$project": {"offer": 0}},
+        ], None, list),
+        "number_of_payments_by_nationality": ([
+            {"$group": {"_id": "$nationality", "num": {"$sum": 1}}},
+        ], None, list),
+    }
+
+
+def offer_cards(now: datetime) -> Dict[str, tuple]:
+    this_month = datetime(now.year, now.month, 1)
+    return {
+        "total_number_of_offers": ([{"$count": "total"}], None, list),
+        "new_offers_this_month": ([
+            {"$match": {"first_seen": {"$gte": this_month}}},
+            {"$count": "total"},
+        ], this_month, list),
+        "number_of_offers_by_tag": ([
+            {"$unwind": "$tags"},
+            {"$group": {"_id": "$tags", "num": {"$sum": 1}}},
+        ], None, list),
+        "number_of_offers": ([{"$count": "total"}], None, _total),
+    }
+
+
+async def _run_cards(collection, prefix, time_field, cards: Dict[str, tuple]) -> Dict[str, Any]:
+    """
+    Cards bounded in time share one $facet over the documents the oldest of
+    them needs. Each unbounded card runs as a query of its own, which can
+    use the indexes a $facet can't, instead of making the $facet scan the
+    whole collection.
+    """
+    bounded = {name: card for name, card in cards.items() if card[1] is not None}
+    unbounded = {name: card for name, card in cards.items() if card[1] is None}
+
+    async def shared():
+        if not bounded:
+            return {}
+        since = min(since for _, since, _ in bounded.values())
+        pipeline = [
+            *prefix,
+            {"$match": {time_field: {"$gte": since}}},
+            {"$facet": {name: card_pipeline for name, (card_pipeline, _, _) in bounded.items()}},
+        ]
+        return (await aggregate(collection, pipeline))[0]
+
+    async def alone(card_pipeline):
+        return await aggregate(collection, [*prefix, *card_pipeline])
+
+    outputs = await asyncio.gather(shared(), *(alone(card_pipeline) for card_pipeline, _, _ in unbounded.values()))
+    outputs = {**outputs[0], **dict(zip(unbounded, outputs[1:]))}
+    return {name: result(outputs[name]) for name, (_, _, result) in cards.items()}
+
+
+async def summary(cards: Iterable[str], userid: Optional[str] = None, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    The KPI `cards` of the dashboard of provider `userid`, or of the DMO,
+    from aggregations over the payments and over the offers run
+    concurrently.
+    """
+    now = now or datetime.now()
+    cards = set(cards)
+
+    payments_prefix = [*await timestamp_stages(repository.payments)]
+    offers_prefix = []
+    if userid is not None:
+        payments_prefix.insert(0, await provider_offers.match(repository.offers_current, userid))
+        offers_prefix.append({"$match": {"userid": userid}})
+
+    payments = {name: card for name, card in payment_cards(now).items() if name in cards}
+    offers = {name: card for name, card in offer_cards(now).items() if name in cards}
+
+    payment_outputs, offer_outputs = await asyncio.gather(
+        _run_cards(repository.payments, payments_prefix, "timestamp", payments),
+        _run_cards(repository.offers_current, offers_prefix, "first_seen", offers),
+    )
+    return {**payment_outputs, **offer_outputs}
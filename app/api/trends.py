@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.api.google_trends import get_trends, slope_and_b_last_3_days, slope_and_b_last_3_months
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Windows of a trend: the SerpAPI date range and the (slope, b) of its values
+WINDOWS = {
+    "days": ("today 1-m", slope_and_b_last_3_days),
+    "months": ("today 3-m", slope_and_b_last_3_months),
+}
+
+# Until a trend is fetched for the first time, it doesn't change the
+# predictions: log(0 * i + 1) == 0
+NEUTRAL = (0.0, 1.0)
+
+Key = Tuple[str, str]
+
+
+class TrendsStore:
+    """
+    (slope, b) of the trend of each search term and window, fetched from
+    SerpAPI by the scheduler in `run`. Requests get the stored value even
+    once it is older than `ttl`, which schedules its refresh, so they never
+    wait on SerpAPI; a failed refresh keeps the previous value, and the
+    trend is not fetched again for `retry_backoff` seconds.
+    """
+
+    def __init__(self, fetch: Callable[[str, str], dict] = get_trends, ttl: float = settings.TRENDS_TTL,
+                 concurrency: int = settings.TRENDS_CONCURRENCY,
+                 retry_backoff: float = settings.TRENDS_RETRY_BACKOFF):
+        self.fetch = fetch
+        self.ttl = float(ttl)
+        self.retry_backoff = float(retry_backoff)
+        self._entries: Dict[Key, Tuple[Tuple[float, float], float]] = {}
+        # Time of the last failed refresh of each trend
+        self._failed: Dict[Key, float] = {}
+        # Every term and window requested, kept fresh by the scheduler
+        self._keys: Set[Key] = set()
+        self._refreshing: Set[Key] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(int(concurrency))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self, term: str, window: str) -> Tuple[float, float]:
+        key = (term, window)
+        with self._lock:
+            self._keys.add(key)
+            entry = self._entries.get(key)
+
+        if entry is None:
+            metrics.incr("trends.misses")
+        elif time.monotonic() - entry[1] >= self.ttl:
+            metrics.incr("trends.stale")
+        else:
+            metrics.incr("trends.hits")
+            return entry[0]
+        self._schedule(key)
+        return NEUTRAL if entry is None else entry[0]
+
+    def prewarm(self, term: str):
+        with self._lock:
+            self._keys.update((term, window) for window in WINDOWS)
+
+    async def run(self, interval: float):
+        """
+        Refreshes the trends due every `interval` seconds, until cancelled.
+        """
+        self._loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await self.refresh_due()
+                await asyncio.sleep(interval)
+        finally:
+            self._loop = None
+
+    def _due(self, key: Key, now: float) -> bool:
+        # Called with the lock held
+        if now - self._failed.get(key, float("-inf")) < self.retry_backoff:
+            return False
+        return key not in self._entries or now - self._entries[key][1] >= self.ttl
+
+    async def refresh_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key in self._keys if self._due(key, now)]
+        await asyncio.gather(*(self.refresh(*key) for key in due))
+
+    async def refresh(self, term: str, window: str):
+        key = (term, window)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        date, slope_and_b = WINDOWS[window]
+        try:
+            async with self._semaphore:
+                with metrics.timer("trends.fetch"):
+                    trends = await asyncio.to_thread(self.fetch, term, date)
+            value = slope_and_b(trends["interest_over_time"]["timeline_data"])
+            with self._lock:
+                self._entries[key] = (value, time.monotonic())
+                self._failed.pop(key, None)
+        except Exception as e:
+            metrics.incr("trends.errors")
+            logger.warning(f"Could not refresh the {window} trend of {term}: {e}")
+            with self._lock:
+                self._failed[key] = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _schedule(self, key: Key):
+        # Callers run in the event loop of the scheduler, which keeps the
+        # refresh tasks referenced until they are done
+        if self._loop is None:
+            return
+        with self._lock:
+            if not self._due(key, time.monotonic()):
+                return
+        task = self._loop.create_task(self.refresh(*key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+trends_store = TrendsStore()
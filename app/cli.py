@@ -0,0 +1,154 @@
+"""
+Maintenance commands for the monitor database.
+
+    python -m app.cli <command> [options]
+"""
+import argparse
+
+from loguru import logger
+
+from app.core.cache import result_cache
+from app.core.config import settings
+from app.core.scopes import GLOBAL_SCOPE, provider_scope
+from app.db.indexes import ensure_indexes, find_collscans
+from app.db.init_db import (get_db, is_timeseries, offers_collection, offers_current_collection,
+                             payments_collection, rollups_collection)
+from app.db.migrations import migrate_payments_to_timeseries, migrate_timestamps
+from app.db.offer_directory import backfill_payment_offers
+from app.db.offer_index import OFFER_INDEX_INDEXES, build_offer_index
+from app.db.rollups import ROLLUP_INDEXES, rebuild_rollups
+
+
+def bump_data_versions():
+    """
+    Drops the cached dashboards computed before a command changed the data,
+    of the DMO and of every provider.
+    """
+    db = get_db()
+    scopes = [GLOBAL_SCOPE, *(provider_scope(userid) for userid in db["offers_current"].distinct("userid"))]
+    if result_cache.versions.bump_shared(db, scopes):
+        logger.info(f"Bumped the data version of {len(scopes)} scopes")
+    else:
+        logger.warning(
+            "Data versions are kept by the API processes, their cached results "
+            f"expire within {settings.RESULT_CACHE_TTL} seconds"
+        )
+
+
+def backfill_payments(args):
+    if is_timeseries(get_db(), "payments"):
+        # Only the meta field of time-series documents can be updated before MongoDB 7.0
+        logger.error("payments is a time-series collection, run backfill-payments before migrating it")
+        raise SystemExit(1)
+    updated = backfill_payment_offers(
+        offers_collection, payments_collection, batch_size=args.batch_size, overwrite=args.overwrite
+    )
+    logger.info(f"Backfilled the offer of {updated} payments")
+    bump_data_versions()
+
+
+def rebuild_payment_rollups(args):
+    rollups_collection.create_indexes(ROLLUP_INDEXES)
+    checked, mismatched = rebuild_rollups(payments_collection, rollups_collection, check_only=args.check)
+    action = "found" if args.check else "corrected"
+    logger.info(f"Checked {checked} rollup buckets, {action} {mismatched} mismatching buckets")
+    if not args.check:
+        bump_data_versions()
+    if args.check and mismatched:
+        raise SystemExit(1)
+
+
+def build_offers_current(args):
+    offers_current_collection.create_indexes(OFFER_INDEX_INDEXES)
+    build_offer_index(offers_collection)
+    logger.info(f"Indexed {offers_current_collection.count_documents({})} offers in offers_current")
+    bump_data_versions()
+
+
+def provision_indexes(args):
+    ensure_indexes(get_db())
+    logger.info("Indexes provisioned")
+
+    if args.explain:
+        collscans = find_collscans(get_db())
+        for name in collscans:
+            logger.warning(f"Query still scans the whole collection: {name}")
+        if not collscans:
+            logger.info("Every query shape uses an index")
+
+
+def migrate_timestamps_to_dates(args):
+    collection = get_db()[args.collection]
+    result = migrate_timestamps(collection, batch_size=args.batch_size, pause=args.pause)
+    logger.info(f"Converted {result['converted']} timestamps of {collection.name}")
+    bump_data_versions()
+    if result["remaining"]:
+        logger.warning(f"{result['remaining']} timestamps of {collection.name} could not be converted")
+        raise SystemExit(1)
+
+
+def migrate_payments_timeseries(args):
+    result = migrate_payments_to_timeseries(get_db(), batch_size=args.batch_size, quiet_seconds=args.quiet_seconds)
+    logger.info(f"Copied {result['copied']} payments to the time-series collection")
+    bump_data_versions()
+    if result["skipped"]:
+        logger.warning(f"Skipped {result['skipped']} payments without a valid timestamp, they remain in payments_regular")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("ensure-indexes", help="create the indexes of the monitor database")
+    command.add_argument(
+        "--explain", action="store_true", help="report the query shapes that still plan a collection scan"
+    )
+    command.set_defaults(handler=provision_indexes)
+
+    command = commands.add_parser(
+        "backfill-payments", help="embed the owner and tags of their offer in existing payments"
+    )
+    command.add_argument("--batch-size", type=int, default=500)
+    command.add_argument(
+        "--overwrite", action="store_true", help="also update payments that were already enriched"
+    )
+    command.set_defaults(handler=backfill_payments)
+
+    command = commands.add_parser(
+        "rebuild-rollups", help="recompute the payment rollups from the stored payments"
+    )
+    command.add_argument(
+        "--check", action="store_true", help="only compare the rollups with the payments, exit 1 on mismatch"
+    )
+    command.set_defaults(handler=rebuild_payment_rollups)
+
+    command = commands.add_parser(
+        "build-offer-index", help="build offers_current from the stored offer versions"
+    )
+    command.set_defaults(handler=build_offers_current)
+
+    command = commands.add_parser(
+        "migrate-timestamps", help="rewrite string timestamps as dates, resuming from the last batch"
+    )
+    command.add_argument("--collection", choices=["payments", "offers"], default="payments")
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.add_argument("--pause", type=float, default=0.0, help="seconds to wait between batches")
+    command.set_defaults(handler=migrate_timestamps_to_dates)
+
+    command = commands.add_parser(
+        "migrate-payments-timeseries",
+        help="copy the payments into a time-series collection, with the consumer stopped",
+    )
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.add_argument(
+        "--quiet-seconds", type=float, default=10.0,
+        help="seconds without new payments required before the collections are swapped",
+    )
+    command.set_defaults(handler=migrate_payments_timeseries)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
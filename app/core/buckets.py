@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from dateutil.relativedelta import relativedelta
+
+# Calendar of the time series: buckets are identified by their start as a
+# naive datetime, generated in order and only formatted as labels at the end
+GRANULARITIES = ("hour", "day", "week", "month", "quarter")
+
+STEPS = {
+    "hour": relativedelta(hours=1),
+    "day": relativedelta(days=1),
+    "week": relativedelta(weeks=1),
+    "month": relativedelta(months=1),
+    "quarter": relativedelta(months=3),
+}
+
+# Number of buckets in a window ending at the current bucket
+WINDOW_SIZES = {"hour": 24, "day": 30, "week": 12, "month": 12, "quarter": 8}
+
+LABEL_FORMATS = {
+    "hour": "%d/%m/%Y %H:00",
+    "day": "%d/%m/%Y",
+    # Weeks start on Monday and are labelled by it
+    "week": "%d/%m/%Y",
+    "month": "%m/%Y",
+}
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp
+    timestamp = timestamp.replace(hour=0)
+    if granularity == "day":
+        return timestamp
+    if granularity == "week":
+        return timestamp - relativedelta(days=timestamp.weekday())
+    timestamp = timestamp.replace(day=1)
+    if granularity == "month":
+        return timestamp
+    return timestamp.replace(month=(timestamp.month - 1) // 3 * 3 + 1)
+
+
+def calendar(granularity: str, now: Optional[datetime] = None, size: Optional[int] = None) -> List[datetime]:
+    """
+    Start of the last `size` buckets of `granularity`, oldest first, the
+    last one being the bucket of `now`.
+    """
+    size = size or WINDOW_SIZES[granularity]
+    last = bucket_start(now or datetime.now(), granularity)
+    return [last - STEPS[granularity] * i for i in reversed(range(size))]
+
+
+def label(bucket: datetime, granularity: str) -> str:
+    if granularity == "quarter":
+        return f"Q{(bucket.month - 1) // 3 + 1}/{bucket.year}"
+    return bucket.strftime(LABEL_FORMATS[granularity])
+
+
+def fill(buckets: List[datetime], granularity: str, values: Dict[datetime, Any], default=0) -> List[Dict[str, Any]]:
+    """
+    The series of `values` by bucket start over `buckets`, with `default`
+    for the buckets without a value.
+    """
+    return [{"date": label(bucket, granularity), "count": values.get(bucket, default)} for bucket in buckets]
+
+
+def trunc_expression(field: str, granularity: str) -> Dict[str, Any]:
+    """
+    Aggregation expression of the bucket start of `field`, the same as
+    bucket_start.
+    """
+    return {"$dateTrunc": {"date": f"${field}", "unit": granularity, "startOfWeek": "monday"}}
@@ -0,0 +1,258 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from bson import Binary
+from fastapi import Request
+from fastapi.responses import Response
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.core.conditional import not_modified, validators
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.responses import dumps
+from app.core.singleflight import SingleFlight
+from app.db.repository import repository
+
+
+class DataVersions:
+    """
+    Ingest watermark of each scope: a version bumped by the consumers every
+    time they store offers or payments of the scope, and the time of the
+    last bump. Cached results remember the version they were computed from
+    and are dropped once it changes.
+
+    With the `name` of a collection, the watermarks are shared through it
+    instead of being kept by this process. Versions kept in memory start
+    over with the process, so they are prefixed with the time it started.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.started = datetime.utcnow()
+        self._epoch = f"{self.started:%Y%m%d%H%M%S%f}."
+        self._versions: Dict[str, int] = {}
+        self._modified: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    async def watermark(self, scope: str) -> Tuple[str, Optional[datetime]]:
+        if self.name is not None:
+            document = await repository.collection(self.name).find_one({"_id": scope})
+            return (str(document["version"]), document.get("modified")) if document else ("0", None)
+        with self._lock:
+            # Data may have changed before the process started
+            return self._epoch + str(self._versions.get(scope, 0)), self._modified.get(scope, self.started)
+
+    @staticmethod
+    def _bumps(scopes: Iterable[str]):
+        return [
+            UpdateOne({"_id": scope}, {"$inc": {"version": 1}, "$currentDate": {"modified": True}}, upsert=True)
+            for scope in scopes
+        ]
+
+    async def bump(self, db, scopes: Iterable[str]):
+        """
+        Called by the consumers with their motor database.
+        """
+        scopes = set(scopes)
+        if self.name is not None:
+            await db[self.name].bulk_write(self._bumps(scopes), ordered=False)
+            return
+        now = datetime.utcnow()
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+                self._modified[scope] = now
+
+    def bump_shared(self, db, scopes: Iterable[str]) -> bool:
+        """
+        Called by the maintenance commands with their pymongo database.
+        Versions kept in memory belong to the API processes and can't be
+        bumped from here, False is returned for them.
+        """
+        if self.name is None:
+            return False
+        scopes = set(scopes)
+        if scopes:
+            db[self.name].bulk_write(self._bumps(scopes), ordered=False)
+        return True
+
+
+class MemoryBackend:
+    """
+    LRU of at most `size` entries, dropped `ttl` seconds after being stored.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            version, expires, body = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                metrics.incr("cache.expired")
+                return None
+            self._entries.move_to_end(key)
+            return version, body
+
+    async def set(self, key: str, version: str, body: bytes):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                metrics.incr("cache.evictions")
+            metrics.gauge("cache.size", len(self._entries))
+
+
+class MongoBackend:
+    """
+    Entries shared through the collection `name`, removed by a TTL index on
+    expires_at. The collection is not bounded by a number of entries.
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        entry = await repository.collection(self.name).find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        return (entry["version"], bytes(entry["body"])) if entry else None
+
+    async def set(self, key: str, version: str, body: bytes):
+        await repository.collection(self.name).replace_one(
+            {"_id": key},
+            {"version": version, "body": Binary(body), "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)},
+            upsert=True,
+        )
+
+
+class ResultCache:
+    """
+    Cache of endpoint results keyed by endpoint, parameters and data scope.
+    Results are kept as the JSON body of their response, so a hit is sent
+    without being encoded again. Identical misses arriving while a result
+    is computed wait for it instead of running the same query.
+    """
+
+    def __init__(self, backend, versions: DataVersions):
+        self.backend = backend
+        self.versions = versions
+        self.flights = SingleFlight("cache.singleflight")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    async def get_or_compute(self, key: str, scope: str, compute: Callable[[], Awaitable[Any]],
+                             version: Optional[str] = None) -> Response:
+        try:
+            # Read before computing: data stored meanwhile bumps the version
+            # and makes the new entry stale at once
+            if version is None:
+                version, _ = await self.versions.watermark(scope)
+            entry = await self.backend.get(key)
+        except PyMongoError as e:
+            logger.warning(f"Result cache unavailable: {e}")
+            return _response(await compute())
+
+        if entry is not None and entry[0] == version:
+            self._count(hit=True)
+            return Response(entry[1], media_type="application/json")
+        if entry is not None:
+            # Replaced by the new result
+            metrics.incr("cache.stale")
+        self._count(hit=False)
+
+        response = await self.flights.do((key, version), lambda: self._compute(key, version, compute))
+        # Each caller gets its own response, their headers are updated
+        return Response(response.body, status_code=response.status_code, headers=dict(response.headers))
+
+    async def _compute(self, key: str, version: str, compute: Callable[[], Awaitable[Any]]) -> Response:
+        response = _response(await compute())
+        if response.status_code == 200:
+            try:
+                await self.backend.set(key, version, response.body)
+            except PyMongoError as e:
+                logger.warning(f"Could not cache {key}: {e}")
+        return response
+
+    def _count(self, hit: bool):
+        metrics.incr("cache.hits" if hit else "cache.misses")
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            metrics.gauge("cache.hit_rate", self.hits / (self.hits + self.misses))
+
+
+def _response(result: Any) -> Response:
+    if isinstance(result, Response):
+        return result
+    return Response(dumps(result), media_type="application/json")
+
+
+def cached(scope: Callable[[Dict[str, Any]], str]):
+    """
+    Caches the responses of an endpoint in `result_cache` and answers
+    conditional requests from the watermark of their data scope, before the
+    endpoint runs. `scope` gives the data scope of a call from its keyword
+    arguments, which FastAPI always uses; every argument but the token
+    payload is part of the key.
+    """
+    def decorator(endpoint):
+        name = f"{endpoint.__module__}.{endpoint.__name__}"
+
+        @wraps(endpoint)
+        async def wrapper(request: Request, **kwargs):
+            params = {key: value for key, value in kwargs.items() if key != "payload"}
+            data_scope = scope(kwargs)
+            key = f"{name}:{data_scope}:{dumps(sorted(params.items())).decode()}"
+            compute = lambda: endpoint(**kwargs)
+
+            try:
+                version, modified = await result_cache.versions.watermark(data_scope)
+            except PyMongoError as e:
+                logger.warning(f"Data versions unavailable: {e}")
+                return _response(await compute())
+
+            headers = validators(key, version, modified)
+            if not_modified(request, headers):
+                metrics.incr("cache.not_modified")
+                return Response(status_code=304, headers=headers)
+
+            response = await result_cache.get_or_compute(key, data_scope, compute, version)
+            response.headers.update(headers)
+            return response
+
+        # FastAPI injects the request, the other parameters are the endpoint's
+        signature = inspect.signature(endpoint)
+        wrapper.__signature__ = signature.replace(parameters=[
+            inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            *(parameter.replace(kind=inspect.Parameter.KEYWORD_ONLY) for parameter in signature.parameters.values()),
+        ])
+        return wrapper
+
+    return decorator
+
+
+def _result_cache() -> ResultCache:
+    if settings.RESULT_CACHE_BACKEND == "mongo":
+        return ResultCache(MongoBackend("result_cache", settings.RESULT_CACHE_TTL), DataVersions("data_versions"))
+    return ResultCache(MemoryBackend(settings.RESULT_CACHE_SIZE, settings.RESULT_CACHE_TTL), DataVersions())
+
+
+result_cache = _result_cache()
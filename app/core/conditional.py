@@ -0,0 +1,49 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import Request
+
+
+def validators(key: str, version: str, modified: Optional[datetime], now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    ETag and Last-Modified of a response from the ingest watermark of its
+    data scope. Responses also depend on the current time through their
+    windows, so both change at least every hour.
+    """
+    hour = (now or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    last_modified = max(modified, hour) if modified else hour
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return {
+        "ETag": f'W/"{digest}-{version}-{hour:%Y%m%d%H}"',
+        "Last-Modified": format_datetime(last_modified.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True),
+        # Stored by browsers, but always revalidated
+        "Cache-Control": "no-cache",
+    }
+
+
+def _weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """
+    Whether the conditional headers of `request` match the validators, as
+    If-None-Match takes precedence over If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        etag = _weak(headers["ETag"])
+        return any(_weak(candidate.strip()) == etag for candidate in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return since >= parsedate_to_datetime(headers["Last-Modified"])
+    return False
@@ -51,6 +51,23 @@ class Settings(BaseSettings):
         f":{MONGO_PASSWORD}@{MONGO_SERVER}"
         f":27017/{MONGO_DB}_test??authSource=admin"
     )
+    # "regular" or "timeseries": how the payments collection is created.
+    # Before MongoDB 7.0 the offer of time-series payments can't be updated,
+    # so payments stored before their offer are never linked to its provider
+    PAYMENTS_STORAGE: str = os.getenv("PAYMENTS_STORAGE", "regular")
+    # Connection pool of the clients. The API serves every request from one
+    # event loop, so the pool, not a threadpool, bounds concurrent queries
+    MONGO_MAX_POOL_SIZE: int = os.getenv("MONGO_MAX_POOL_SIZE", 100)
+    MONGO_MIN_POOL_SIZE: int = os.getenv("MONGO_MIN_POOL_SIZE", 0)
+    MONGO_MAX_IDLE_TIME_MS: int = os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000)
+    # Milliseconds to wait for a connection from the pool before failing
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)
+    MONGO_CONNECT_TIMEOUT_MS: int = os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+    MONGO_SOCKET_TIMEOUT_MS: int = os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000)
+    # Comma separated wire compressors, in order of preference. zstd and
+    # snappy need the zstandard and python-snappy packages
+    MONGO_COMPRESSORS: str = os.getenv("MONGO_COMPRESSORS", "zlib")
 
     # RabbitMQ
     RABBITMQ_HOST: str = os.getenv("RABBITMQ_HOST", "rabbitmq")
@@ -58,6 +75,21 @@ class Settings(BaseSettings):
     RABBITMQ_VIRTUAL_HOST: str = os.getenv("RABBITMQ_VIRTUAL_HOST", "/")
     RABBITMQ_USERNAME: str = os.getenv("RABBITMQ_USERNAME", "user")
     RABBITMQ_PASSWORD: str = os.getenv("RABBITMQ_PASSWORD", "user")
+    # Messages buffered per queue before a bulk insert, and the maximum
+    # number of seconds a message may wait in the buffer
+    RABBITMQ_BATCH_SIZE: int = os.getenv("RABBITMQ_BATCH_SIZE", 500)
+    RABBITMQ_FLUSH_INTERVAL: float = os.getenv("RABBITMQ_FLUSH_INTERVAL", 1.0)
+    # Unacknowledged messages the broker may deliver per queue; two batches
+    # so one can be written while the next one fills
+    RABBITMQ_PREFETCH_COUNT: int = os.getenv("RABBITMQ_PREFETCH_COUNT", 1000)
+    RABBITMQ_SHUTDOWN_TIMEOUT: float = os.getenv("RABBITMQ_SHUTDOWN_TIMEOUT", 10.0)
+
+    # Result cache of the analytics endpoints
+    RESULT_CACHE_SIZE: int = os.getenv("RESULT_CACHE_SIZE", 1024)
+    RESULT_CACHE_TTL: float = os.getenv("RESULT_CACHE_TTL", 300.0)
+    # "memory", exact with a single worker, or "mongo" to share cached
+    # results and data versions between workers and instances
+    RESULT_CACHE_BACKEND: str = os.getenv("RESULT_CACHE_BACKEND", "memory")
 
     # JWT
     JWT_SECRET_KEY_PATH: str = "./dev-keys/jwt-key"
@@ -65,9 +97,23 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: timedelta = timedelta(hours=1)
     REFRESH_TOKEN_EXPIRE_MINUTES: timedelta = timedelta(days=7)
     JWT_ALGORITHM: str = "RS256"
+    # Verified tokens kept, each until it expires
+    TOKEN_CACHE_SIZE: int = os.getenv("TOKEN_CACHE_SIZE", 4096)
 
     # Google Trends
     GOOGLE_TRENDS_API_KEY: str = os.getenv("GOOGLE_TRENDS_API_KEY")
+    # Term of the trend adjusting the predictions
+    TRENDS_SEARCH_TERM: str = os.getenv("TRENDS_SEARCH_TERM", "Aveiro")
+    # Age after which a stored trend is refreshed, it is still served meanwhile
+    TRENDS_TTL: float = os.getenv("TRENDS_TTL", 3600.0)
+    TRENDS_REFRESH_INTERVAL: float = os.getenv("TRENDS_REFRESH_INTERVAL", 60.0)
+    # SerpAPI requests running at once
+    TRENDS_CONCURRENCY: int = os.getenv("TRENDS_CONCURRENCY", 2)
+    # Seconds before a trend whose refresh failed is fetched again
+    TRENDS_RETRY_BACKOFF: float = os.getenv("TRENDS_RETRY_BACKOFF", 300.0)
+
+    # Seconds between two computations of the stored /prediction forecasts
+    FORECAST_REFRESH_INTERVAL: float = os.getenv("FORECAST_REFRESH_INTERVAL", 900.0)
 
 
 settings = Settings()
@@ -0,0 +1,56 @@
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any
+
+import orjson
+from bson import Decimal128, ObjectId, json_util
+from fastapi.responses import ORJSONResponse
+
+_EPOCH = datetime(1970, 1, 1)
+_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _encode_datetime(value: datetime):
+    # Naive datetimes are UTC, as pymongo returns them
+    if value.tzinfo is not None and value.utcoffset():
+        return json_util.default(value)
+    naive = value.replace(tzinfo=None)
+    if naive < _EPOCH:
+        return json_util.default(value)
+
+    millis = value.microsecond // 1000
+    fraction = ".%03d" % millis if millis else ""
+    return {"$date": "%04d-%02d-%02dT%02d:%02d:%02d%sZ" % (
+        value.year, value.month, value.day, value.hour, value.minute, value.second, fraction
+    )}
+
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return _encode_datetime(value)
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, Decimal128):
+        return {"$numberDecimal": str(value)}
+    # RawBSONDocument and other read-only mappings
+    if isinstance(value, Mapping):
+        return dict(value)
+    return json_util.default(value)
+
+
+def dumps(content: Any) -> bytes:
+    """
+    JSON of `content` in a single pass, with the BSON types written as
+    json_util.dumps writes them in relaxed extended JSON.
+    """
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """
+    Response of documents read from MongoDB, returned as is by the
+    endpoints so FastAPI doesn't convert them with jsonable_encoder first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,17 @@
+from typing import List, Optional
+
+# Data scopes: what the DMO sees, and what each provider sees of its own offers
+GLOBAL_SCOPE = "global"
+
+
+def provider_scope(uid: str) -> str:
+    return f"provider:{uid}"
+
+
+def data_scopes(uid: Optional[str]) -> List[str]:
+    """
+    Scopes whose data changes with an offer or payment of provider `uid`.
+    """
+    if uid is None:
+        return [GLOBAL_SCOPE]
+    return [GLOBAL_SCOPE, provider_scope(uid)]
@@ -0,0 +1,36 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from app.core.metrics import metrics
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, all made in the same
+    event loop: the first one runs the function and the others wait for it
+    and share its result, or its exception. Calls made once it is done run
+    the function again.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self.collapsed = 0
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._futures.get(key)
+        if future is None:
+            future = self._futures[key] = asyncio.ensure_future(fn())
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self._collapse()
+        # A cancelled caller doesn't cancel the call the others wait for
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._futures.get(key) is future:
+            del self._futures[key]
+
+    def _collapse(self):
+        self.collapsed += 1
+        metrics.incr(f"{self.name}.collapsed")
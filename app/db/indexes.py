@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Any, Dict, List
+
+from loguru import logger
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from app.db.offer_index import OFFER_INDEX_INDEXES
+from app.db.rollups import ROLLUP_INDEXES
+
+# Indexes of every collection of the monitor database. create_indexes is a
+# no-op for indexes that already exist, so the registry is applied on every
+# startup.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "offers": [
+        # Lookups of the newest version of an offer
+        IndexModel([("id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("userid", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("tags", ASCENDING)]),
+        # Pages of /offers sorted by timestamp
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "payments": [
+        # _id breaks ties between the pages of /payments sorted by timestamp
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)]),
+        # Also the provider dashboards, which match the ids of the provider's offers
+        IndexModel([("offer_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "payment_rollups": ROLLUP_INDEXES,
+    "offers_current": OFFER_INDEX_INDEXES,
+    # Shared result cache, entries are removed once expired
+    "result_cache": [IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)],
+}
+
+_SOME_DATE = datetime(2024, 1, 1)
+
+# Representative queries of the endpoints and consumers, checked with
+# explain to find the ones that still scan a whole collection. Payment
+# pipelines are listed as they run once timestamps are migrated to dates.
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    {"name": "newest offer version", "collection": "offers",
+     "find": {"id": 0}, "sort": {"timestamp": -1}},
+    {"name": "offers of a provider", "collection": "offers",
+     "find": {"userid": ""}},
+    {"name": "payments of an offer", "collection": "payments",
+     "find": {"offer_id": 0}},
+    {"name": "payments of a provider", "collection": "payments",
+     "find": {"offer_id": {"$in": [0, 1]}}},
+    {"name": "payments this month", "collection": "payments", "pipeline": [
+        {"$match": {"timestamp": {"$gte": _SOME_DATE}}},
+    ]},
+    {"name": "provider payments this month", "collection": "payments", "pipeline": [
+        {"$match": {"offer_id": {"$in": [0, 1]}}},
+        {"$match": {"timestamp": {"$gte": _SOME_DATE}}},
+    ]},
+    {"name": "last payments", "collection": "payments", "pipeline": [
+        {"$sort": {"timestamp": -1}},
+        {"$limit": 5},
+    ]},
+    {"name": "rollup series", "collection": "payment_rollups",
+     "find": {"scope": "global", "granularity": "day", "bucket": {"$gte": _SOME_DATE}}},
+    {"name": "new offers in a period", "collection": "offers_current",
+     "find": {"first_seen": {"$gte": _SOME_DATE}}},
+    {"name": "offers of a provider (current)", "collection": "offers_current",
+     "find": {"userid": ""}},
+]
+
+
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        names = db[collection].create_indexes(indexes)
+        logger.debug(f"Indexes of {collection}: {', '.join(names)}")
+
+
+def _has_collscan(plan) -> bool:
+    if isinstance(plan, list):
+        return any(_has_collscan(stage) for stage in plan)
+    if not isinstance(plan, dict):
+        return False
+    if plan.get("stage") == "COLLSCAN":
+        return True
+    return any(_has_collscan(value) for key, value in plan.items() if key != "rejectedPlans")
+
+
+def find_collscans(db) -> List[str]:
+    """
+    Names of the query shapes whose winning plan scans a whole collection.
+    """
+    collscans = []
+    for shape in QUERY_SHAPES:
+        if "pipeline" in shape:
+            command = {"aggregate": shape["collection"], "pipeline": shape["pipeline"], "cursor": {}}
+        else:
+            command = {"find": shape["collection"], "filter": shape["find"]}
+            if "sort" in shape:
+                command["sort"] = shape["sort"]
+
+        explain = db.command("explain", command, verbosity="queryPlanner")
+        if _has_collscan(explain):
+            collscans.append(shape["name"])
+    return collscans
@@ -1,14 +1,58 @@
 import os
 
+from loguru import logger
 from pymongo import MongoClient
 
 from app.core.config import settings
 
-client = MongoClient(str(settings.MONGO_URI))
+def client_options():
+    """
+    Pool, timeout and compression options of the pymongo and motor clients.
+    """
+    return {
+        "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        "compressors": settings.MONGO_COMPRESSORS,
+    }
+
+# Blocking client of the CLI, the index provisioning and the benchmarks, the
+# API queries through the motor client of app.db.repository
+client = MongoClient(str(settings.MONGO_URI), **client_options())
 db = client[settings.MONGO_DB]
 
 offers_collection = db["offers"]
 payments_collection = db["payments"]
+rollups_collection = db["payment_rollups"]
+offers_current_collection = db["offers_current"]
+
+# Payments as a time-series collection: bucketed and compressed per offer,
+# which the provider dashboards match on. The embedded offer snapshot
+# changes with every version of the offer's tags, so it is a measurement
+PAYMENTS_TIMESERIES = {"timeField": "timestamp", "metaField": "offer_id", "granularity": "hours"}
 
 def get_db():
     return db
+
+def is_timeseries(db, name):
+    collections = list(db.list_collections(filter={"name": name}))
+    return bool(collections) and collections[0]["type"] == "timeseries"
+
+def create_payments_collection(db):
+    """
+    Creates the payments collection with the layout of PAYMENTS_STORAGE if
+    it doesn't exist yet. An existing collection is never converted here,
+    that is done by `python -m app.cli migrate-payments-timeseries`.
+    """
+    if settings.PAYMENTS_STORAGE != "timeseries":
+        return
+
+    if "payments" not in db.list_collection_names():
+        db.create_collection("payments", timeseries=PAYMENTS_TIMESERIES)
+        logger.info("Created payments as a time-series collection")
+    elif not is_timeseries(db, "payments"):
+        logger.warning("payments is a regular collection, run the time-series migration to convert it")
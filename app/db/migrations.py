@@ -0,0 +1,197 @@
+import time
+from typing import Any, Dict, List
+
+from loguru import logger
+from pymongo.errors import CollectionInvalid
+
+from app.db.indexes import INDEXES
+from app.db.init_db import PAYMENTS_TIMESERIES, is_timeseries
+
+# Progress of the migrations is kept in the migrations collection, one
+# document per migration and collection, so they can resume where they
+# stopped
+TIMESTAMPS_MIGRATION = "timestamps_to_dates"
+TIMESERIES_MIGRATION = "payments_to_timeseries"
+
+TO_DATE_STAGE = {"$addFields": {"timestamp": {"$toDate": "$timestamp"}}}
+
+# Like TO_DATE_STAGE, but strings $toDate can't convert are kept instead of
+# failing the pipeline, and fall out of any range of dates
+LENIENT_TO_DATE_STAGE = {"$addFields": {"timestamp": {
+    "$convert": {"input": "$timestamp", "to": "date", "onError": "$timestamp"},
+}}}
+
+# Seconds before a collection that is not migrated yet is checked again
+_RECHECK_INTERVAL = 60
+_finished = set()
+_last_check: Dict[str, float] = {}
+
+
+def _migration_id(collection) -> str:
+    return f"{TIMESTAMPS_MIGRATION}:{collection.name}"
+
+
+def migrate_timestamps(collection, batch_size=1000, pause=0.0) -> Dict[str, Any]:
+    """
+    Rewrites the string timestamps of `collection` as dates, in batches of
+    `batch_size` documents in _id order. The last migrated _id is saved
+    after every batch, so an interrupted migration resumes from there.
+    Strings that $toDate cannot convert are left untouched and reported.
+    """
+    migrations = collection.database["migrations"]
+    migration_id = _migration_id(collection)
+    state = migrations.find_one({"_id": migration_id}) or {"last_id": None, "converted": 0}
+
+    while True:
+        query = {"timestamp": {"$type": "string"}}
+        if state["last_id"] is not None:
+            query["_id"] = {"$gt": state["last_id"]}
+        ids = [document["_id"] for document in collection.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+        if not ids:
+            break
+
+        # Converted the same way the pipelines converted them on every query
+        result = collection.update_many(
+            {"_id": {"$in": ids}, "timestamp": {"$type": "string"}},
+            [{"$set": {"timestamp": {"$convert": {"input": "$timestamp", "to": "date", "onError": "$timestamp"}}}}],
+        )
+        state["last_id"] = ids[-1]
+        state["converted"] += result.modified_count
+        migrations.update_one(
+            {"_id": migration_id},
+            {"$set": {"last_id": state["last_id"], "converted": state["converted"], "done": False}},
+            upsert=True,
+        )
+        logger.info(f"Converted {state['converted']} timestamps of {collection.name}")
+
+        if pause:
+            time.sleep(pause)
+
+    remaining = collection.count_documents({"timestamp": {"$type": "string"}})
+    migrations.update_one(
+        {"_id": migration_id},
+        {"$set": {"done": remaining == 0, "remaining": remaining}},
+        upsert=True,
+    )
+    return {"converted": state["converted"], "remaining": remaining}
+
+
+async def timestamps_migrated(collection) -> bool:
+    name = collection.full_name
+    if name in _finished:
+        return True
+    if time.monotonic() - _last_check.get(name, float("-inf")) < _RECHECK_INTERVAL:
+        return False
+
+    _last_check[name] = time.monotonic()
+    database = collection.database
+    if await database["migrations"].find_one({"_id": _migration_id(collection), "done": True}):
+        _finished.add(name)
+        return True
+    # The time field of a time-series collection only holds dates
+    cursor = await database.list_collections(filter={"name": collection.name})
+    collections = await cursor.to_list(None)
+    if collections and collections[0]["type"] == "timeseries":
+        _finished.add(name)
+        return True
+    return False
+
+
+async def timestamp_stages(collection) -> List[Dict[str, Any]]:
+    """
+    Stages that make `timestamp` a date at the start of a pipeline. Once the
+    timestamps of the collection are migrated there are none, so range
+    predicates on timestamp can use the index.
+    """
+    return [] if await timestamps_migrated(collection) else [TO_DATE_STAGE]
+
+
+def _quiet(collection, seconds: float) -> bool:
+    before = collection.estimated_document_count()
+    time.sleep(seconds)
+    return collection.estimated_document_count() == before
+
+
+def _restore_payments(db):
+    # Payments stored between the rename and the creation went to a new
+    # regular payments collection
+    stored = list(db["payments"].find())
+    if stored:
+        db["payments_regular"].insert_many(stored, ordered=False)
+    db["payments"].drop()
+    db["payments_regular"].rename("payments")
+
+
+def migrate_payments_to_timeseries(db, batch_size=1000, quiet_seconds=10.0) -> Dict[str, Any]:
+    """
+    Moves the regular payments collection to a time-series one. The regular
+    collection is renamed to payments_regular and an empty time-series
+    payments collection, with the indexes of payments, takes its place.
+
+    The consumer must be stopped: a payment stored between the rename and
+    the creation would create a regular payments collection again. No
+    payment may be stored for `quiet_seconds` before the rename, and the
+    rename is undone if one was stored anyway. Time-series collections
+    cannot be renamed, so the payments are copied into the new collection
+    rather than swapped in once copied. They are copied newest first, so
+    the dashboards, which mostly read recent payments, are complete again
+    after the first batches.
+
+    The last copied _id is checkpointed after every batch. Time-series
+    collections don't enforce unique _ids, so a batch interrupted between
+    its insert and its checkpoint is copied twice when resumed.
+    """
+    migrations = db["migrations"]
+    if not is_timeseries(db, "payments"):
+        names = db.list_collection_names()
+        if "payments_regular" in names:
+            raise RuntimeError("payments_regular already exists, refusing to overwrite it")
+        if "payments" in names:
+            if not _quiet(db["payments"], quiet_seconds):
+                raise RuntimeError("Payments are still being stored, stop the consumer before migrating")
+            db["payments"].rename("payments_regular")
+        try:
+            db.create_collection("payments", timeseries=PAYMENTS_TIMESERIES)
+        except CollectionInvalid:
+            _restore_payments(db)
+            raise RuntimeError("A payment was stored during the migration, stop the consumer and run it again")
+        db["payments"].create_indexes(INDEXES["payments"])
+        logger.info("Renamed payments to payments_regular and created the time-series payments")
+
+    source, target = db["payments_regular"], db["payments"]
+    state = migrations.find_one({"_id": TIMESERIES_MIGRATION}) or {"last_id": None, "copied": 0, "skipped": 0}
+
+    while True:
+        match = {} if state["last_id"] is None else {"_id": {"$lt": state["last_id"]}}
+        batch = list(source.aggregate([
+            {"$match": match},
+            {"$sort": {"_id": -1}},
+            {"$limit": batch_size},
+            # The time field must be a date
+            {"$addFields": {"timestamp": {"$convert": {
+                "input": "$timestamp", "to": "date", "onError": None, "onNull": None,
+            }}}},
+        ]))
+        if not batch:
+            break
+
+        documents = [document for document in batch if document["timestamp"] is not None]
+        if documents:
+            target.insert_many(documents, ordered=False)
+
+        state["last_id"] = batch[-1]["_id"]
+        state["copied"] += len(documents)
+        state["skipped"] += len(batch) - len(documents)
+        migrations.update_one(
+            {"_id": TIMESERIES_MIGRATION},
+            {"$set": {"last_id": state["last_id"], "copied": state["copied"], "skipped": state["skipped"], "done": False}},
+            upsert=True,
+        )
+        logger.info(f"Copied {state['copied']} payments to the time-series collection")
+
+    migrations.update_one({"_id": TIMESERIES_MIGRATION}, {"$set": {"done": True}}, upsert=True)
+    # Every timestamp of a time-series collection is a date
+    migrations.update_one(
+        {"_id": _migration_id(target)}, {"$set": {"done": True, "remaining": 0}}, upsert=True
+    )
+    return {"copied": state["copied"], "skipped": state["skipped"]}
@@ -0,0 +1,128 @@
+import time
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from pymongo import UpdateMany
+from pymongo.errors import PyMongoError
+
+# Latest version of every offer: the offers collection keeps one document
+# per version, the newest one holds the current owner and tags
+LATEST_OFFERS_PIPELINE = [
+    {"$sort": {"timestamp": 1}},
+    {"$group": {"_id": "$id", "userid": {"$last": "$userid"}, "tags": {"$last": "$tags"}}},
+]
+
+# Seconds an offer not found in the offers collection is not looked up
+# again, and the most of them remembered
+MISSING_OFFER_TTL = 30.0
+MISSING_OFFERS_SIZE = 10000
+
+
+def offer_summary(offer: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The part of an offer that is embedded in its payments as `offer`.
+    """
+    return {"userid": offer.get("userid"), "tags": offer.get("tags") or []}
+
+
+class OfferDirectory:
+    """
+    In-process map of offer id to the owning provider and current tags,
+    kept up to date by the offer consumer and used to enrich payments
+    when they are stored. Offers that could not be found are remembered
+    for MISSING_OFFER_TTL seconds, so payments for them don't cost a
+    lookup each.
+    """
+
+    def __init__(self):
+        self._offers: Dict[Any, Dict[str, Any]] = {}
+        self._missing: Dict[Any, float] = {}
+        self._collection = None
+
+    def __len__(self):
+        return len(self._offers)
+
+    async def load(self, offers_current_collection, offers_collection):
+        """
+        Fills the directory from offers_current. Offers missing from it are
+        looked up in the offers collection.
+        """
+        self._collection = offers_collection
+        try:
+            async for offer in offers_current_collection.find({}, {"userid": 1, "tags": 1}):
+                self._offers[offer["_id"]] = offer_summary(offer)
+        except PyMongoError as e:
+            logger.warning(f"Could not load the offer directory: {e}")
+            return
+        logger.info(f"Loaded {len(self._offers)} offers into the offer directory")
+
+    def update(self, offer: Dict[str, Any]):
+        self._offers[offer["id"]] = offer_summary(offer)
+        self._missing.pop(offer["id"], None)
+
+    async def resolve(self, offer_id) -> Optional[Dict[str, Any]]:
+        summary = self._offers.get(offer_id)
+        if summary is not None or self._collection is None:
+            return summary
+
+        now = time.monotonic()
+        if self._missing.get(offer_id, now) > now:
+            return None
+        self._missing.pop(offer_id, None)
+
+        offer = await self._collection.find_one(
+            {"id": offer_id}, {"userid": 1, "tags": 1}, sort=[("timestamp", -1)]
+        )
+        if offer is not None:
+            summary = self._offers[offer_id] = offer_summary(offer)
+            return summary
+
+        self._missing[offer_id] = now + MISSING_OFFER_TTL
+        if len(self._missing) > MISSING_OFFERS_SIZE:
+            # The oldest entries go first
+            del self._missing[next(iter(self._missing))]
+        return None
+
+    async def enrich(self, payment: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Embeds the owner and tags of the paid offer in the payment, so
+        provider and tag queries don't need to join the offers collection.
+        """
+        summary = await self.resolve(payment["offer_id"])
+        if summary is None:
+            logger.warning(f"Payment for unknown offer {payment['offer_id']} stored without enrichment")
+        else:
+            payment["offer"] = dict(summary)
+        return payment
+
+
+offer_directory = OfferDirectory()
+
+
+def backfill_payment_offers(offers_collection, payments_collection, batch_size=500, overwrite=False):
+    """
+    Embeds the owner and tags of their offer in the stored payments. Only
+    payments without `offer` are updated unless `overwrite` is set, so the
+    backfill can be rerun after an interruption.
+    """
+    updated = 0
+    operations = []
+
+    def write():
+        nonlocal updated, operations
+        if operations:
+            updated += payments_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    for offer in offers_collection.aggregate(LATEST_OFFERS_PIPELINE, allowDiskUse=True):
+        query = {"offer_id": offer["_id"]}
+        if not overwrite:
+            query["offer"] = {"$exists": False}
+        operations.append(UpdateMany(query, {"$set": {"offer": offer_summary(offer)}}))
+
+        if len(operations) >= batch_size:
+            write()
+            logger.info(f"Backfilled {updated} payments")
+    write()
+
+    return updated
@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, IndexModel, UpdateOne
+
+# offers_current holds one document per offer, keyed by the offer id:
+# {_id, first_seen, last_seen, userid, tags}, userid and tags taken from the
+# newest version
+OFFER_INDEX_INDEXES = [
+    IndexModel([("first_seen", ASCENDING)]),
+    IndexModel([("userid", ASCENDING), ("first_seen", ASCENDING)]),
+    IndexModel([("tags", ASCENDING)]),
+]
+
+
+def _merge_version(first_seen, last_seen, userid, tags) -> Dict[str, Any]:
+    # Expressions refer to the stored document, so versions can be merged
+    # in any order and more than once
+    newer = {"$gte": [last_seen, {"$ifNull": ["$last_seen", last_seen]}]}
+    return {"$set": {
+        "first_seen": {"$min": ["$first_seen", first_seen]},
+        "last_seen": {"$max": ["$last_seen", last_seen]},
+        "userid": {"$cond": [newer, userid, "$userid"]},
+        "tags": {"$cond": [newer, tags, "$tags"]},
+    }}
+
+
+def offer_index_updates(offers: Iterable[Dict[str, Any]]) -> List[UpdateOne]:
+    return [
+        UpdateOne(
+            {"_id": offer["id"]},
+            [_merge_version(
+                {"$literal": offer["timestamp"]},
+                {"$literal": offer["timestamp"]},
+                {"$literal": offer["userid"]},
+                {"$literal": offer.get("tags") or []},
+            )],
+            upsert=True,
+        )
+        for offer in offers
+    ]
+
+
+async def store_offer_index(db, offers: List[Dict[str, Any]]):
+    operations = offer_index_updates(offers)
+    if operations:
+        await db["offers_current"].bulk_write(operations, ordered=False)
+
+
+def build_offer_index(offers_collection):
+    """
+    Builds offers_current from every stored offer version. Offers that are
+    already indexed are merged, so the builder can run while offers are
+    being ingested.
+    """
+    offers_collection.aggregate([
+        {"$addFields": {"timestamp": {"$toDate": "$timestamp"}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": "$id",
+            "first_seen": {"$min": "$timestamp"},
+            "last_seen": {"$max": "$timestamp"},
+            "userid": {"$last": "$userid"},
+            "tags": {"$last": "$tags"},
+        }},
+        {"$merge": {
+            "into": "offers_current",
+            "on": "_id",
+            "whenMatched": [_merge_version(
+                "$$new.first_seen", "$$new.last_seen", "$$new.userid", "$$new.tags"
+            )],
+            "whenNotMatched": "insert",
+        }},
+    ], allowDiskUse=True)
+
+
+async def count_offers_first_seen_before(offers_current_collection, boundaries: List[datetime],
+                                   query: Optional[Dict[str, Any]] = None) -> List[int]:
+    """
+    Number of offers matching `query` first seen before each of the
+    ascending `boundaries`, from a single scan of the first_seen index
+    followed by a running sum.
+    """
+    pipeline = [
+        {"$match": {**(query or {}), "first_seen": {"$lt": boundaries[-1]}}},
+        {"$bucket": {
+            "groupBy": "$first_seen",
+            "boundaries": boundaries,
+            "default": "before",
+            "output": {"count": {"$sum": 1}},
+        }},
+    ]
+    counts = {bucket["_id"]: bucket["count"] async for bucket in offers_current_collection.aggregate(pipeline)}
+
+    total = counts.get("before", 0)
+    totals = [total]
+    for lower in boundaries[:-1]:
+        total += counts.get(lower, 0)
+        totals.append(total)
+    return totals
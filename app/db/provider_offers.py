@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List
+
+from app.core.metrics import metrics
+
+# Offer ids are cached for the providers with the most recent dashboard
+# requests. Offers stored by this process invalidate their provider, the
+# TTL bounds how stale the ids can be when another process stored them.
+CACHE_SIZE = 256
+CACHE_TTL = 60.0
+
+
+class ProviderOffers:
+    """
+    Resolves a provider to the ids of its offers, from the userid index of
+    offers_current, so provider pipelines can start with a match on the
+    (offer_id, timestamp) index of payments.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._ids: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by invalidate, ids read before an invalidation are not cached
+        self._generation = 0
+
+    async def offer_ids(self, offers_current_collection, userid: str) -> List:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._ids.get(userid)
+            if cached is not None and now - cached[1] < self.ttl:
+                self._ids.move_to_end(userid)
+                metrics.incr("provider_offers.hits")
+                return cached[0]
+            generation = self._generation
+
+        metrics.incr("provider_offers.misses")
+        ids = [offer["_id"] async for offer in offers_current_collection.find({"userid": userid}, {"_id": 1})]
+        with self._lock:
+            if generation == self._generation:
+                self._ids[userid] = (ids, now)
+                self._ids.move_to_end(userid)
+                while len(self._ids) > self.size:
+                    self._ids.popitem(last=False)
+        return ids
+
+    async def match(self, offers_current_collection, userid: str):
+        """
+        First stage of the pipelines over the payments of provider `userid`.
+        """
+        return {"$match": {"offer_id": {"$in": await self.offer_ids(offers_current_collection, userid)}}}
+
+    def invalidate(self, userids: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+            for userid in userids:
+                self._ids.pop(userid, None)
+
+
+provider_offers = ProviderOffers()
@@ -0,0 +1,59 @@
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+
+from app.core.config import settings
+from app.db.init_db import client_options
+
+
+class Repository:
+    """
+    Collections of the monitor database for the API, on a motor client
+    opened and closed by the application's lifespan so its pool lives in
+    the event loop serving the requests.
+    """
+
+    def __init__(self):
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db = None
+
+    def connect(self, uri: Optional[str] = None, name: Optional[str] = None, **options):
+        self.client = AsyncIOMotorClient(str(uri or settings.MONGO_URI), **{**client_options(), **options})
+        self.db = self.client[name or settings.MONGO_DB]
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = self.db = None
+
+    def collection(self, name: str) -> AsyncIOMotorCollection:
+        if self.db is None:
+            raise RuntimeError("The repository is not connected, it is opened by the application's lifespan")
+        return self.db[name]
+
+    @property
+    def payments(self) -> AsyncIOMotorCollection:
+        return self.collection("payments")
+
+    @property
+    def offers(self) -> AsyncIOMotorCollection:
+        return self.collection("offers")
+
+    @property
+    def offers_current(self) -> AsyncIOMotorCollection:
+        return self.collection("offers_current")
+
+    @property
+    def rollups(self) -> AsyncIOMotorCollection:
+        return self.collection("payment_rollups")
+
+    @property
+    def forecasts(self) -> AsyncIOMotorCollection:
+        return self.collection("forecasts")
+
+
+async def aggregate(collection, pipeline: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+    return await collection.aggregate(pipeline, **kwargs).to_list(None)
+
+
+repository = Repository()
@@ -0,0 +1,172 @@
+import math
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DeleteOne, IndexModel, UpdateOne
+
+from app.core.buckets import bucket_start, calendar, trunc_expression
+from app.core.scopes import data_scopes
+
+# Payment counts and amount sums are kept per (scope, granularity, bucket
+# start) and incremented as payments are stored
+GRANULARITIES = ("hour", "day", "month")
+
+ROLLUP_INDEXES = [
+    IndexModel([("scope", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)], unique=True),
+]
+
+# Marker in the migrations collection written once the rollups were rebuilt
+# from the stored payments. The consumer only adds the payments it stores,
+# so until then the rollups miss every payment stored before them
+ROLLUPS_MIGRATION = "payment_rollups"
+
+# Seconds before rollups that are not built yet are checked again
+_RECHECK_INTERVAL = 60
+_built = set()
+_last_check: Dict[str, float] = {}
+
+def _key(scope: str, granularity: str, bucket: datetime) -> Dict[str, Any]:
+    return {"scope": scope, "granularity": granularity, "bucket": bucket}
+
+
+def rollup_updates(payments: Iterable[Dict[str, Any]], scopes=data_scopes) -> List[UpdateOne]:
+    """
+    Upserts that add a batch of payments to the rollups of the `scopes` of
+    their provider, one per bucket touched by the batch.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for payment in payments:
+        userid = (payment.get("offer") or {}).get("userid")
+        for scope in scopes(userid):
+            for granularity in GRANULARITIES:
+                total = totals[(scope, granularity, bucket_start(payment["timestamp"], granularity))]
+                total[0] += 1
+                total[1] += payment.get("amount") or 0
+
+    return [
+        UpdateOne(_key(*key), {"$inc": {"count": count, "amount": amount}}, upsert=True)
+        for key, (count, amount) in totals.items()
+    ]
+
+
+async def store_rollups(db, payments: List[Dict[str, Any]], scopes=data_scopes):
+    operations = rollup_updates(payments, scopes)
+    if operations:
+        await db["payment_rollups"].bulk_write(operations, ordered=False)
+
+
+async def rollup_totals(collection, scope: str, granularity: str, first: datetime, last: datetime,
+                  fields: Iterable[str]) -> Dict[datetime, Dict[str, Any]]:
+    """
+    The stored `fields` of the buckets of `granularity` from `first` to
+    `last`, by bucket start. Buckets without payments are missing.
+    """
+    projection = {"_id": 0, "bucket": 1, **{field: 1 for field in fields}}
+    return {
+        rollup["bucket"]: rollup
+        async for rollup in collection.find(
+            {"scope": scope, "granularity": granularity, "bucket": {"$gte": first, "$lte": last}},
+            projection,
+        )
+    }
+
+
+async def rollup_matrix(collection, scope_prefix: str, granularity: str, field: str,
+                  now: Optional[datetime] = None) -> Tuple[List[datetime], Dict[str, List[float]]]:
+    """
+    The buckets of the /analysis window of `granularity` and the series of
+    `field` of every scope starting with `scope_prefix` that has payments
+    in it, read with a single query.
+    """
+    buckets = calendar(granularity, now)
+    positions = {bucket: position for position, bucket in enumerate(buckets)}
+    series = defaultdict(lambda: [0] * len(buckets))
+    query = {
+        "scope": {"$regex": f"^{re.escape(scope_prefix)}"},
+        "granularity": granularity,
+        "bucket": {"$gte": buckets[0], "$lte": buckets[-1]},
+    }
+    async for rollup in collection.find(query, {"_id": 0, "scope": 1, "bucket": 1, field: 1}):
+        series[rollup["scope"]][positions[rollup["bucket"]]] = rollup.get(field, 0)
+    return buckets, dict(series)
+
+
+def _raw_totals(payments_collection) -> Dict[tuple, List[float]]:
+    totals = defaultdict(lambda: [0, 0])
+    for granularity in GRANULARITIES:
+        pipeline = [
+            {"$addFields": {"timestamp": {"$toDate": "$timestamp"}}},
+            {"$group": {
+                "_id": {
+                    "bucket": trunc_expression("timestamp", granularity),
+                    "userid": "$offer.userid",
+                },
+                "count": {"$sum": 1},
+                "amount": {"$sum": "$amount"},
+            }},
+        ]
+        for row in payments_collection.aggregate(pipeline, allowDiskUse=True):
+            for scope in data_scopes(row["_id"].get("userid")):
+                total = totals[(scope, granularity, row["_id"]["bucket"])]
+                total[0] += row["count"]
+                total[1] += row["amount"]
+    return totals
+
+
+def _matches(rollup, count, amount) -> bool:
+    return (
+        rollup is not None
+        and rollup["count"] == count
+        and math.isclose(rollup["amount"], amount, rel_tol=1e-9, abs_tol=1e-6)
+    )
+
+
+def rebuild_rollups(payments_collection, rollups_collection, check_only=False, batch_size=1000):
+    """
+    Recomputes the rollups from the stored payments and compares them with
+    the current ones. Unless `check_only` is set, mismatching rollups are
+    corrected and rollups without payments are removed.
+
+    Returns the number of buckets checked and the number that mismatched.
+    """
+    expected = _raw_totals(payments_collection)
+    current = {
+        (rollup["scope"], rollup["granularity"], rollup["bucket"]): rollup
+        for rollup in rollups_collection.find({}, {"_id": 0})
+    }
+
+    operations = []
+    for key, (count, amount) in expected.items():
+        if not _matches(current.pop(key, None), count, amount):
+            operations.append(UpdateOne(_key(*key), {"$set": {"count": count, "amount": amount}}, upsert=True))
+    operations.extend(DeleteOne(_key(*key)) for key in current)
+
+    if not check_only:
+        for i in range(0, len(operations), batch_size):
+            rollups_collection.bulk_write(operations[i:i + batch_size], ordered=False)
+        rollups_collection.database["migrations"].update_one(
+            {"_id": ROLLUPS_MIGRATION}, {"$set": {"done": True}}, upsert=True
+        )
+
+    return len(expected), len(operations)
+
+
+async def rollups_built(collection) -> bool:
+    """
+    Whether `rebuild_rollups` has run on the rollups `collection`, so they
+    can be read instead of aggregating the payments.
+    """
+    name = collection.full_name
+    if name in _built:
+        return True
+    if time.monotonic() - _last_check.get(name, float("-inf")) < _RECHECK_INTERVAL:
+        return False
+
+    _last_check[name] = time.monotonic()
+    if await collection.database["migrations"].find_one({"_id": ROLLUPS_MIGRATION, "done": True}):
+        _built.add(name)
+        return True
+    return False
@@ -1,17 +1,66 @@
-from threading import Thread
+import asyncio
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from loguru import logger
+from pymongo.errors import PyMongoError
 
+from app.api import dmo, forecast_table, provider
 from app.api import router as api_router
+from app.api.trends import trends_store
 from app.core.config import settings
-from app.db.init_db import get_db
-from app.rabbitmq.handler import consume_messages
+from app.core.metrics import metrics
+from app.core.responses import MongoJSONResponse
+from app.db.indexes import ensure_indexes
+from app.db.init_db import create_payments_collection, get_db
+from app.db.repository import repository
+from app.rabbitmq.handler import Consumer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Provisions the collections and indexes, opens the motor client of the
+    repository, starts the RabbitMQ consumer and the trends and forecasts
+    schedulers with the application and stops them on shutdown.
+    """
+    try:
+        await asyncio.to_thread(create_payments_collection, get_db())
+        await asyncio.to_thread(ensure_indexes, get_db())
+    except PyMongoError as e:
+        logger.error(f"Could not provision the database indexes: {e}")
+
+    repository.connect()
+
+    trends = None
+    if settings.GOOGLE_TRENDS_API_KEY:
+        trends_store.prewarm(settings.TRENDS_SEARCH_TERM)
+        trends = asyncio.create_task(trends_store.run(float(settings.TRENDS_REFRESH_INTERVAL)))
+    else:
+        logger.warning("GOOGLE_TRENDS_API_KEY is not set, predictions are made without the trend")
+
+    forecasts = asyncio.create_task(forecast_table.run(
+        float(settings.FORECAST_REFRESH_INTERVAL), dmo.function_map_analysis, provider.function_map
+    ))
+
+    consumer = Consumer()
+    await consumer.start()
+    yield
+    await consumer.stop()
+
+    forecasts.cancel()
+    if trends is not None:
+        trends.cancel()
+    repository.close()
+
 
 app = FastAPI(
     title="Monitor Microservice",
     description="This is a very fancy project, with auto docs for the API and everything",
     version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=MongoJSONResponse,
 )
 
 app.add_middleware(
@@ -20,19 +69,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(api_router, prefix="/api")
 
-@app.on_event("startup")
-def lifespan():
-    get_db()
-
-@app.on_event("startup")
-def startup_event():
-    """
-    Function to run at the startup of the FastAPI application.
-    """
-    # Start consuming messages in a separate thread
-    thread = Thread(target=consume_messages)
-    thread.start()
\ No newline at end of file
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
@@ -0,0 +1,71 @@
+import ast
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Union
+
+from pydantic import AfterValidator, ConfigDict, TypeAdapter, ValidationError, with_config
+from typing_extensions import Annotated, TypedDict
+
+
+class DecodeError(ValueError):
+    """
+    Raised when a message body is not a valid offer or payment.
+    """
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    # MongoDB stores dates as UTC without an offset, the same way $toDate
+    # interprets the timestamp strings stored before
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+Timestamp = Annotated[datetime, AfterValidator(_to_naive_utc)]
+
+
+@with_config(ConfigDict(extra="allow"))
+class OfferMessage(TypedDict):
+    id: Union[int, str]
+    userid: str
+    tags: List[str]
+    timestamp: Timestamp
+
+
+@with_config(ConfigDict(extra="allow"))
+class PaymentMessage(TypedDict):
+    offer_id: Union[int, str]
+    amount: float
+    timestamp: Timestamp
+
+
+offer_adapter = TypeAdapter(OfferMessage)
+payment_adapter = TypeAdapter(PaymentMessage)
+
+
+def _decode(adapter: TypeAdapter, body: bytes) -> Dict[str, Any]:
+    try:
+        return adapter.validate_json(body)
+    except ValidationError as e:
+        if e.errors()[0]["type"] != "json_invalid":
+            raise DecodeError(str(e)) from e
+
+    # Some producers publish the repr of a Python dict instead of JSON
+    try:
+        value = ast.literal_eval(body.decode())
+        return adapter.validate_python(value)
+    except (ValueError, TypeError, SyntaxError, RecursionError, ValidationError) as e:
+        raise DecodeError(str(e)) from e
+
+
+def decode_offer(body: bytes) -> Dict[str, Any]:
+    """
+    Decodes and validates an offer message into the document to be stored.
+    """
+    return _decode(offer_adapter, body)
+
+
+def decode_payment(body: bytes) -> Dict[str, Any]:
+    """
+    Decodes and validates a payment message into the document to be stored.
+    """
+    return _decode(payment_adapter, body)
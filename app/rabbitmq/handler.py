@@ -1,73 +1,501 @@
-from threading import Thread
+import asyncio
+import time
+from collections import defaultdict
+from functools import partial
+from typing import Any, Dict, List, Tuple
 
-import pika
-from fastapi import HTTPException
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage
 from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError, PyMongoError
 
+from app.core.cache import result_cache
 from app.core.config import settings
-from app.db.init_db import offers_collection, payments_collection
+from app.core.metrics import metrics
+from app.core.scopes import data_scopes, provider_scope
+from app.db.init_db import client_options
+from app.db.offer_directory import offer_directory, offer_summary
+from app.db.offer_index import store_offer_index
+from app.db.provider_offers import provider_offers
+from app.db.rollups import store_rollups
+from app.rabbitmq.decoding import DecodeError, decode_offer, decode_payment
 
 
-def on_message_store_offer_datawarehouse(channel, method, properties, body):
+# Outcomes of a delivery
+ACK = "ack"
+REQUEUE = "requeue"
+REJECT = "reject"
+
+
+class Settlements:
+    """
+    Settles the deliveries of one channel with the broker in delivery tag
+    order. aio-pika handles every delivery in its own task, so they are
+    done with out of order; a delivery settled before one with a lower
+    tag waits for it, and each run of consecutive tags with the same
+    outcome is then settled with one multi-ack or multi-nack. A multi-ack
+    thus never covers a delivery that is still being handled.
+
+    Every queue must be consumed on its own channel: delivery tags are scoped
+    to the channel, so a multi-ack would otherwise also acknowledge messages
+    still waiting in the buffer of another queue.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        # Highest tag settled with the broker, and the deliveries above it
+        # that are done with
+        self.last_tag = 0
+        self._done: Dict[int, Tuple[AbstractIncomingMessage, str]] = {}
+        self._lock = asyncio.Lock()
+
+    def reset(self):
+        """
+        Called when the channel is restored: the broker redelivers what was
+        not settled, with tags starting over.
+        """
+        self.last_tag = 0
+        self._done.clear()
+
+    async def ack(self, messages):
+        await self._settle(messages, ACK)
+
+    async def requeue(self, messages):
+        await self._settle(messages, REQUEUE)
+
+    async def reject(self, messages):
+        await self._settle(messages, REJECT)
+
+    async def _settle(self, messages, outcome):
+        for message in messages:
+            # Deliveries of a channel lost meanwhile are redelivered anyway
+            if not message.channel.is_closed:
+                self._done[message.delivery_tag] = (message, outcome)
+
+        async with self._lock:
+            runs = []
+            while self.last_tag + 1 in self._done:
+                self.last_tag += 1
+                message, outcome = self._done.pop(self.last_tag)
+                if runs and runs[-1][1] == outcome:
+                    runs[-1][0] = message
+                else:
+                    runs.append([message, outcome])
+
+            for message, outcome in runs:
+                try:
+                    if outcome == ACK:
+                        await message.ack(multiple=True)
+                    else:
+                        await message.nack(multiple=True, requeue=outcome == REQUEUE)
+                except Exception as e:
+                    # The channel was lost, the broker will redeliver what
+                    # was not settled on the restored channel
+                    logger.warning(f"Could not settle messages from {self.queue}: {e}")
+
+
+class BatchWriter:
+    """
+    Buffers the messages of one queue and stores them with a single unordered
+    insert_many, settling the whole batch through the `settlements` of the
+    channel.
+    """
+
+    def __init__(self, queue, collection, max_size, max_interval, on_stored=None, settlements=None,
+                 prepare=None):
+        self.queue = queue
+        self.collection = collection
+        self.max_size = max_size
+        self.max_interval = max_interval
+        # Called with the documents of a batch before it is stored, so
+        # messages reach the buffer without waiting on anything
+        self.prepare = prepare
+        # Called with the stored documents before the batch is acknowledged
+        self.on_stored = on_stored
+        self.settlements = settlements or Settlements(queue)
+
+        self.documents = []
+        self.messages = []
+        self.last_flush = time.monotonic()
+        # Only one batch per queue is written at a time; while it is being
+        # written the buffer keeps filling up to the channel prefetch
+        self._lock = asyncio.Lock()
+
+    async def add(self, message, document):
+        self.documents.append(document)
+        self.messages.append(message)
+        metrics.gauge(f"ingest.{self.queue}.buffer_size", len(self.documents))
+
+        if len(self.documents) >= self.max_size:
+            await self.flush()
+
+    def is_due(self):
+        return time.monotonic() - self.last_flush >= self.max_interval
+
+    def discard(self):
+        """
+        Drops the buffer without acknowledging it. Used when the channel is
+        lost, since the broker redelivers every unacknowledged message.
+        """
+        self.documents, self.messages = [], []
+        metrics.gauge(f"ingest.{self.queue}.buffer_size", 0)
+
+    async def flush(self):
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self):
+        now = time.monotonic()
+        if not self.documents:
+            self.last_flush = now
+            return
+
+        documents, messages = self.documents, self.messages
+        self.documents, self.messages = [], []
+        metrics.observe(f"ingest.{self.queue}.flush_interval", now - self.last_flush)
+        self.last_flush = now
+
+        stored = documents
+        start = time.perf_counter()
+        try:
+            if self.prepare is not None:
+                await self.prepare(documents)
+            await self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # The rest of the batch was written; the failed documents would
+            # fail again (e.g. duplicate keys), so they are not requeued
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            stored = [document for i, document in enumerate(documents) if i not in failed]
+            logger.error(
+                f"{len(failed)} of {len(documents)} messages from {self.queue} could not be stored"
+            )
+            metrics.incr(f"ingest.{self.queue}.write_errors", len(failed))
+        except PyMongoError as e:
+            logger.error(f"Failed to store {len(documents)} messages from {self.queue}: {e}")
+            metrics.incr(f"ingest.{self.queue}.failed_flushes")
+            await self.settlements.requeue(messages)
+            return
+        finally:
+            metrics.observe(f"ingest.{self.queue}.flush_latency", time.perf_counter() - start)
+            metrics.gauge(f"ingest.{self.queue}.buffer_size", len(self.documents))
+
+        if self.on_stored is not None:
+            try:
+                await self.on_stored(stored)
+            except PyMongoError as e:
+                # The documents are stored, requeueing them would duplicate them
+                logger.error(f"Failed to update derived data for {self.queue}: {e}")
+                metrics.incr(f"ingest.{self.queue}.derived_errors")
+
+        await self.settlements.ack(messages)
+        metrics.incr(f"ingest.{self.queue}.stored", len(stored))
+        logger.info(f"Stored {len(stored)} of {len(documents)} messages from {self.queue}")
+
+
+class DeadLetterQueue:
+    """
+    Moves messages that cannot be decoded to `<queue>.dead_letter`, keeping
+    the original body and the reason, so they neither block the queue nor
+    get lost. They are settled in order with the batches of the channel.
+    """
+
+    def __init__(self, queue, channel, settlements):
+        self.queue = queue
+        self.name = f"{queue}.dead_letter"
+        self.channel = channel
+        self.settlements = settlements
+
+    async def declare(self):
+        await self.channel.declare_queue(self.name, durable=True)
+
+    async def publish(self, message: AbstractIncomingMessage, error: Exception):
+        logger.warning(f"Dead-lettering malformed message from {self.queue}: {error}")
+        metrics.incr(f"ingest.{self.queue}.dead_lettered")
+        try:
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(
+                    message.body,
+                    headers={"x-original-queue": self.queue, "x-error": str(error)[:1024]},
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                ),
+                routing_key=self.name,
+            )
+        except Exception as e:
+            logger.error(f"Could not dead-letter message from {self.queue}: {e}")
+            await self.settlements.reject([message])
+            return
+        await self.settlements.ack([message])
+
+
+async def on_message_store_offer_datawarehouse(
+    writer: BatchWriter, dead_letters: DeadLetterQueue, message: AbstractIncomingMessage
+):
     """
-    Function to store an offer in the MongoDB database.
+    Function to buffer an offer to be stored in the MongoDB database.
     """
-    body = body.decode()
+    try:
+        offer = decode_offer(message.body)
+    except DecodeError as e:
+        await dead_letters.publish(message, e)
+        return
+
+    # Payments for this offer may arrive before the offer batch is written
+    offer_directory.update(offer)
+    await writer.add(message, offer)
 
-    # Json
-    body = eval(body)
 
+async def on_message_payment(
+    writer: BatchWriter, dead_letters: DeadLetterQueue, message: AbstractIncomingMessage
+):
+    """
+    Function to buffer a payment to be stored in the MongoDB database.
+    """
     try:
-        offers_collection.insert_one(body)
-        logger.info("Offer stored successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        payment = decode_payment(message.body)
+    except DecodeError as e:
+        await dead_letters.publish(message, e)
+        return
+
+    # Enriched with the rest of its batch when it is written
+    await writer.add(message, payment)
+
+
+async def enrich_payments(payments):
+    for payment in payments:
+        await offer_directory.enrich(payment)
 
 
-def on_message_payment(channel, method, properties, body):
+async def offers_embeddable(db) -> bool:
     """
-    Function to update the relevance_score of an offer in the Elasticsearch index.
+    Whether the offer of stored payments can be updated. Before MongoDB 7.0
+    only the meta field of a time-series collection can be, and payments
+    are bucketed by offer_id.
     """
-    body = body.decode()
+    cursor = await db.list_collections(filter={"name": "payments"})
+    collections = await cursor.to_list(None)
+    if not collections or collections[0]["type"] != "timeseries":
+        return True
+    return (await db.client.server_info())["versionArray"] >= [7]
 
-    # Json
-    body = eval(body)
+
+async def embed_current_offers(db, payments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Embeds their offer from offers_current in the stored `payments` that
+    were stored without one, and returns those it was embedded in. Provider
+    dashboards match payments by offer id, so these payments count toward
+    their provider once the offer is known, and its rollups must too.
+    """
+    missing = list({payment["offer_id"] for payment in payments if not payment.get("offer")})
+    if not missing:
+        return []
+    summaries = {
+        offer["_id"]: offer_summary(offer)
+        async for offer in db["offers_current"].find({"_id": {"$in": missing}}, {"userid": 1, "tags": 1})
+    }
+
+    by_offer = defaultdict(list)
+    for payment in payments:
+        if not payment.get("offer") and payment["offer_id"] in summaries:
+            by_offer[payment["offer_id"]].append(payment)
+    if not by_offer:
+        return []
 
     try:
-        payments_collection.insert_one(body)
-        logger.info("Payment stored successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-def consume_messages():
-    """
-    Function to consume messages from RabbitMQ.
-    """
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(
-            host=settings.RABBITMQ_HOST,
-            port=settings.RABBITMQ_PORT,
-            virtual_host=settings.RABBITMQ_VIRTUAL_HOST,
-            credentials=pika.PlainCredentials(username=settings.RABBITMQ_USERNAME, password=settings.RABBITMQ_PASSWORD),
-        )
-    )
-    
-    channel = connection.channel()
-
-    channel.queue_declare(queue="store_offer_datawarehouse")
-    channel.queue_declare(queue="payment")
-
-
-    channel.basic_consume(
-        queue="store_offer_datawarehouse",
-        on_message_callback=on_message_store_offer_datawarehouse,
-        auto_ack=True,
-    )
-
-    channel.basic_consume(
-        queue="payment",
-        on_message_callback=on_message_payment,
-        auto_ack=True,
-    )
-
-    channel.start_consuming()
\ No newline at end of file
+        await db["payments"].bulk_write([
+            UpdateMany(
+                {"_id": {"$in": [payment["_id"] for payment in group]}, "offer": {"$exists": False}},
+                {"$set": {"offer": summaries[offer_id]}},
+            )
+            for offer_id, group in by_offer.items()
+        ], ordered=False)
+    except PyMongoError as e:
+        # Left to the backfill, they only count toward the global scope meanwhile
+        logger.warning(f"Could not embed the offer of payments stored before it: {e}")
+        return []
+
+    embedded = []
+    for offer_id, group in by_offer.items():
+        for payment in group:
+            payment["offer"] = summaries[offer_id]
+            embedded.append(payment)
+    return embedded
+
+
+async def store_offers(db, offers, embed_offers=True):
+    await store_offer_index(db, offers)
+    # Only once offers_current has them, so a reload sees the new offers
+    provider_offers.invalidate({offer["userid"] for offer in offers})
+
+    if embed_offers:
+        # Payments stored before their offer was known are in the global
+        # rollups already, they are added to their provider's
+        orphans = await db["payments"].find({
+            "offer_id": {"$in": list({offer["id"] for offer in offers})},
+            "offer": {"$exists": False},
+            "timestamp": {"$type": "date"},
+        }).to_list(None)
+        adopted = await embed_current_offers(db, orphans)
+        await store_rollups(db, adopted, scopes=lambda userid: [provider_scope(userid)])
+
+    await result_cache.versions.bump(db, {scope for offer in offers for scope in data_scopes(offer["userid"])})
+
+
+async def store_payments(db, payments, embed_offers=True):
+    if embed_offers:
+        # The offer of payments that could not be enriched may be known by now
+        await embed_current_offers(db, payments)
+    await store_rollups(db, payments)
+    await result_cache.versions.bump(db, {
+        scope for payment in payments for scope in data_scopes((payment.get("offer") or {}).get("userid"))
+    })
+
+
+# Queue, collection, message callback, coroutine run with each batch
+# before it is stored and coroutine run with the database and each stored
+# batch
+QUEUES = [
+    ("store_offer_datawarehouse", "offers", on_message_store_offer_datawarehouse, None, store_offers),
+    ("payment", "payments", on_message_payment, enrich_payments, store_payments),
+]
+
+
+class Consumer:
+    """
+    Consumes the RabbitMQ queues on the running event loop and writes the
+    messages to MongoDB through motor.
+
+    Flow control comes from the channel prefetch: the broker stops delivering
+    once a queue has RABBITMQ_PREFETCH_COUNT unacknowledged messages, which
+    bounds both the buffers and the batches being written.
+    """
+
+    def __init__(self):
+        self.writers = []
+        self.settlements = []
+        self._consumers = []
+        self._connection = None
+        self._mongo = None
+        self._task = None
+        self._flusher = None
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops consuming, writes and acknowledges what is still buffered and
+        closes the connections.
+        """
+        self._stopping.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, settings.RABBITMQ_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("RabbitMQ consumer did not drain before the shutdown timeout")
+
+    async def _run(self):
+        # The pool, timeout and compression options of the API's client
+        self._mongo = AsyncIOMotorClient(str(settings.MONGO_URI), **client_options())
+        try:
+            if await self._connect():
+                await self._consume()
+                await self._stopping.wait()
+        finally:
+            await self._drain()
+
+    async def _connect(self):
+        delay = 1
+        while not self._stopping.is_set():
+            try:
+                # A robust connection restores channels, qos and consumers
+                # by itself when the broker connection drops
+                self._connection = await aio_pika.connect_robust(
+                    host=settings.RABBITMQ_HOST,
+                    port=settings.RABBITMQ_PORT,
+                    virtualhost=settings.RABBITMQ_VIRTUAL_HOST,
+                    login=settings.RABBITMQ_USERNAME,
+                    password=settings.RABBITMQ_PASSWORD,
+                )
+                return True
+            except (ConnectionError, aio_pika.exceptions.AMQPError) as e:
+                logger.warning(f"Could not connect to RabbitMQ, retrying in {delay}s: {e}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    delay = min(delay * 2, 30)
+        return False
+
+    async def _consume(self):
+        db = self._mongo[settings.MONGO_DB]
+        self._connection.reconnect_callbacks.add(self._on_reconnect)
+        await offer_directory.load(db["offers_current"], db["offers"])
+        embed_offers = await offers_embeddable(db)
+        if not embed_offers:
+            logger.warning(
+                "payments is a time-series collection, payments stored before their offer "
+                "only count toward the global scope"
+            )
+
+        for queue_name, collection_name, callback, prepare, on_stored in QUEUES:
+            channel = await self._connection.channel()
+            await channel.set_qos(prefetch_count=settings.RABBITMQ_PREFETCH_COUNT)
+            queue = await channel.declare_queue(queue_name)
+            settlements = Settlements(queue_name)
+            self.settlements.append(settlements)
+            dead_letters = DeadLetterQueue(queue_name, channel, settlements)
+            await dead_letters.declare()
+
+            writer = BatchWriter(
+                queue_name,
+                db[collection_name],
+                max_size=settings.RABBITMQ_BATCH_SIZE,
+                max_interval=settings.RABBITMQ_FLUSH_INTERVAL,
+                on_stored=partial(on_stored, db, embed_offers=embed_offers) if on_stored else None,
+                settlements=settlements,
+                prepare=prepare,
+            )
+            self.writers.append(writer)
+
+            consumer_tag = await queue.consume(partial(callback, writer, dead_letters))
+            self._consumers.append((queue, consumer_tag))
+
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        logger.info("Consuming RabbitMQ queues")
+
+    def _on_reconnect(self, *args):
+        for writer in self.writers:
+            writer.discard()
+        for settlements in self.settlements:
+            settlements.reset()
+
+    async def _flush_periodically(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), settings.RABBITMQ_FLUSH_INTERVAL / 2)
+            except asyncio.TimeoutError:
+                pass
+
+            for writer in self.writers:
+                if writer.is_due():
+                    await writer.flush()
+
+    async def _drain(self):
+        if self._flusher is not None:
+            await self._flusher
+
+        for queue, consumer_tag in self._consumers:
+            try:
+                await queue.cancel(consumer_tag)
+            except Exception as e:
+                logger.warning(f"Could not cancel consumer of {queue.name}: {e}")
+
+        for writer in self.writers:
+            await writer.flush()
+
+        if self._connection is not None:
+            await self._connection.close()
+        self._mongo.close()
+        logger.info("RabbitMQ consumer stopped")
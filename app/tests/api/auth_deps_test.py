@@ -0,0 +1,46 @@
+import time
+
+import pytest
+from jose import JWTError, jwt
+
+from app.api import auth_deps
+
+
+def token(**claims):
+    now = int(time.time())
+    payload = {"sub": "p1", "name": "Provider", "scopes": ["provider"], "tags": [], "type": "access",
+               "iat": now, "exp": now + 3600, **claims}
+    return jwt.encode(payload, auth_deps.private_key, algorithm="RS256")
+
+
+def test_verified_tokens_are_cached(monkeypatch):
+    monkeypatch.setattr(auth_deps, "verified_tokens", auth_deps.VerifiedTokens(size=2))
+    verifications = []
+    decode = jwt.decode
+    monkeypatch.setattr(auth_deps.jwt, "decode", lambda *args, **kwargs: verifications.append(1) or decode(*args, **kwargs))
+
+    first = token()
+    assert auth_deps.decode_token(first)["sub"] == "p1"
+    assert auth_deps.decode_token(first)["sub"] == "p1"
+    assert len(verifications) == 1
+
+    # Least recently used tokens are verified again
+    auth_deps.decode_token(token(sub="p2"))
+    auth_deps.decode_token(token(sub="p3"))
+    auth_deps.decode_token(first)
+    assert len(verifications) == 4
+
+    with pytest.raises(JWTError):
+        auth_deps.decode_token(first[:-4] + "AAAA")
+    with pytest.raises(JWTError):
+        auth_deps.decode_token(first[:-4] + "AAAA")
+    assert len(verifications) == 6
+
+
+def test_tokens_are_dropped_once_expired():
+    tokens = auth_deps.VerifiedTokens(size=10)
+    tokens.set(b"digest", {"sub": "p1", "exp": 1000})
+
+    assert tokens.get(b"digest", now=999) == {"sub": "p1", "exp": 1000}
+    assert tokens.get(b"digest", now=1000) is None
+    assert tokens.get(b"digest", now=999) is None
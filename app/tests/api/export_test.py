@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+from datetime import datetime
+
+import pytest
+from bson import decode_all, encode
+from bson.raw_bson import RawBSONDocument
+
+from app.api import export
+from app.api.export import export_response
+from app.db.migrations import LENIENT_TO_DATE_STAGE
+from app.tests.fakes import AsyncCursor
+
+PAYMENTS = [
+    {"_id": 1, "offer_id": 7, "amount": 12.5, "nationality": "PT",
+     "timestamp": datetime(2024, 5, 1, 10), "offer": {"userid": "p1", "tags": ["boat"]}},
+    {"_id": 2, "offer_id": 8, "amount": 3.0, "nationality": "ES", "timestamp": "2024-05-02T11:00:00"},
+]
+
+
+class FakeCollection:
+    def __init__(self, documents=PAYMENTS):
+        self.documents = documents
+        self.query = self.pipeline = None
+
+    def with_options(self, codec_options):
+        assert codec_options.document_class is RawBSONDocument
+        return self
+
+    def find(self, query, projection=None, batch_size=None):
+        self.query = query
+        return AsyncCursor(RawBSONDocument(encode(document)) for document in self.documents)
+
+    def aggregate(self, pipeline, batchSize=None):
+        self.pipeline = pipeline
+        return AsyncCursor(RawBSONDocument(encode(document)) for document in self.documents)
+
+
+async def migrated(collection):
+    return True
+
+
+async def not_migrated(collection):
+    return False
+
+
+def body(response):
+    async def read():
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(read())
+
+
+def test_csv_export(monkeypatch):
+    monkeypatch.setattr(export, "timestamps_migrated", migrated)
+    collection = FakeCollection()
+
+    response = asyncio.run(export_response(collection, "payments", "csv", since=datetime(2024, 5, 1), gzip=True))
+
+    assert response.headers["content-disposition"] == 'attachment; filename="payments.csv.gz"'
+    assert collection.query == {"timestamp": {"$gte": datetime(2024, 5, 1)}}
+    assert gzip.decompress(body(response)).decode().splitlines() == [
+        "_id,offer_id,amount,nationality,timestamp,userid",
+        "1,7,12.5,PT,2024-05-01T10:00:00,p1",
+        "2,8,3.0,ES,2024-05-02T11:00:00,",
+    ]
+
+
+def test_bson_export_passes_documents_through():
+    assert decode_all(body(asyncio.run(export_response(FakeCollection(), "payments", "bson")))) == PAYMENTS
+
+
+def test_range_of_timestamps_not_migrated_is_compared_as_dates(monkeypatch):
+    monkeypatch.setattr(export, "timestamps_migrated", not_migrated)
+    collection = FakeCollection()
+
+    body(asyncio.run(export_response(collection, "payments", "csv", until=datetime(2024, 6, 1))))
+
+    assert collection.query is None
+    assert collection.pipeline[:2] == [LENIENT_TO_DATE_STAGE, {"$match": {"timestamp": {"$lt": datetime(2024, 6, 1)}}}]
+
+
+def test_values_that_cannot_be_converted_are_exported_as_nulls():
+    pyarrow = pytest.importorskip("pyarrow")
+    collection = FakeCollection([
+        *PAYMENTS,
+        {"_id": 3, "offer_id": "abc", "amount": "1.5", "nationality": "FR", "timestamp": "yesterday"},
+    ])
+
+    reader = pyarrow.ipc.open_stream(body(asyncio.run(export_response(collection, "payments", "arrow"))))
+
+    table = reader.read_all().to_pydict()
+    assert table["offer_id"] == [7, 8, None]
+    assert table["amount"] == [12.5, 3.0, 1.5]
+    assert table["timestamp"] == [datetime(2024, 5, 1, 10), datetime(2024, 5, 2, 11), None]
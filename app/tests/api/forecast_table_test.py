@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+
+from app.api import forecast_table
+
+NOW = datetime(2024, 5, 10, 14, 30)
+
+
+class FakeForecasts:
+    def __init__(self):
+        self.documents = {}
+
+    async def find_one(self, query, projection=None):
+        document = self.documents.get(query["_id"])
+        if document is None or document["bucket"] != query["bucket"]:
+            return None
+        return document
+
+    async def replace_one(self, query, document, upsert=False):
+        self.documents[query["_id"]] = document
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            self.documents[operation._filter["_id"]] = operation._doc
+
+
+def series(values):
+    calls = []
+
+    async def read():
+        calls.append(1)
+        return [{"date": str(i), "count": value} for i, value in enumerate(values)]
+
+    return read, calls
+
+
+def test_predictions_are_served_from_the_table(monkeypatch):
+    monkeypatch.setattr(forecast_table, "_trend", lambda granularity: (0.0, 1.0))
+    table = FakeForecasts()
+    read, calls = series([10, 20, 30, 40])
+
+    def predict(horizon=3, refresh=False, now=NOW):
+        return asyncio.run(forecast_table.stored_prediction("global", "day", "profit", horizon, "linear", read,
+                                                            refresh, collection=table, now=now))
+
+    first = predict()
+    assert [point["date"] for point in first] == ["11/05/2024", "12/05/2024", "13/05/2024"]
+    assert round(first[0]["count"]) == 50
+    assert predict(horizon=2) == first[:2]
+    assert len(calls) == 1
+
+    predict(refresh=True)
+    assert len(calls) == 2
+    # Computed again once the dates move on
+    assert predict(now=datetime(2024, 5, 11, 1))[0]["date"] == "12/05/2024"
+    assert len(calls) == 3
+
+
+def test_refresh_stores_every_scope(monkeypatch):
+    monkeypatch.setattr(forecast_table, "_trend", lambda granularity: (0.0, 1.0))
+    monkeypatch.setattr(forecast_table, "get_series", lambda metric, granularity, now: series([1, 2, 3])[0]())
+
+    async def provider_predictions(metric, granularity, horizon, method, trend, now):
+        return {
+            "p1": [{"date": "11/05/2024", "count": 1.0, "lower": 0.0, "upper": 2.0}],
+            "p2": [{"date": "11/05/2024", "count": 2.0, "lower": 1.0, "upper": 3.0}],
+        }
+
+    monkeypatch.setattr(forecast_table, "provider_predictions", provider_predictions)
+    table = FakeForecasts()
+
+    stored = asyncio.run(forecast_table.refresh_forecasts(
+        [("day", "profit"), ("month", "new_offers")], [("day", "profit")], collection=table, now=NOW
+    ))
+
+    assert stored == 4
+    assert set(table.documents) == {
+        "global:day:profit", "global:month:new_offers", "provider:p1:day:profit", "provider:p2:day:profit",
+    }
+    assert table.documents["provider:p2:day:profit"]["predictions"]["holt"][0]["count"] == 2.0
+    assert len(table.documents["global:day:profit"]["predictions"]["linear"]) == forecast_table.MAX_HORIZON
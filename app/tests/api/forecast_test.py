@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.api.forecast import forecast, prediction, trend_regressor
+
+HORIZON = 3
+
+
+def two_slopes(values):
+    # The previous /prediction: a line through the last 3 points
+    slope = ((values[:, -2] - values[:, -3]) + (values[:, -1] - values[:, -2])) / 2
+    b = (values[:, -3] + values[:, -2] - (values[:, -1] - values[:, -2])) / 2
+    return slope[:, None] * np.arange(3, 3 + HORIZON) + b[:, None]
+
+
+def synthetic(series=500, points=30, seed=7):
+    rng = np.random.default_rng(seed)
+    t = np.arange(points + HORIZON)
+    level = rng.uniform(20, 200, (series, 1))
+    slope = rng.uniform(-1, 3, (series, 1))
+    noise = rng.normal(0, 1, (series, points + HORIZON)) * level * 0.1
+    values = level + slope * t + noise
+    return values[:, :points], values[:, points:]
+
+
+@pytest.mark.parametrize("method", ["holt", "linear"])
+def test_backtest_beats_the_two_slope_heuristic(method):
+    history, actual = synthetic()
+    result = forecast(history, HORIZON, method)
+
+    error = np.abs(result.mean - actual).mean()
+    assert error < 0.6 * np.abs(two_slopes(history) - actual).mean()
+
+    # Close to 95% of the actual values fall in the bands
+    covered = ((actual >= result.lower) & (actual <= result.upper)).mean()
+    assert 0.85 <= covered <= 0.99
+
+
+@pytest.mark.parametrize("method", ["holt", "linear"])
+def test_batches_match_single_series(method):
+    history, _ = synthetic(series=20)
+    batch = forecast(history, HORIZON, method)
+    for row, values in enumerate(history):
+        single = forecast(values, HORIZON, method)
+        assert np.allclose(single.mean[0], batch.mean[row])
+        assert np.allclose(single.upper[0], batch.upper[row])
+
+
+def test_prediction_response():
+    series = [{"date": f"{month:02d}/2024", "count": 10 * month} for month in range(1, 13)]
+    response = prediction(series, "month", horizon=2, method="linear", trend=(0.0, 1.0), now=datetime(2024, 12, 5))
+
+    assert [point["date"] for point in response] == ["01/2025", "02/2025"]
+    assert response[0]["count"] == pytest.approx(130)
+    assert response[0]["lower"] <= response[0]["count"] <= response[0]["upper"]
+    # The neutral trend changes nothing
+    assert np.allclose(trend_regressor(0.0, 1.0), 0)
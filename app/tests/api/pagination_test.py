@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime
+
+import mongomock
+import pytest
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+
+from app.api import pagination
+from app.api.pagination import PageParams, encode_cursor, page_filter, paginate
+from app.db.migrations import LENIENT_TO_DATE_STAGE
+from app.tests.fakes import AsyncCollection, AsyncCursor
+
+
+def params(**overrides):
+    values = {"limit": 10, "cursor": None, "sort": "_id", "since": None, "until": None, "format": "json"}
+    return PageParams(**{**values, **overrides})
+
+
+def test_timestamp_cursor_continues_after_the_last_document():
+    last = {"_id": ObjectId(), "timestamp": datetime(2024, 5, 1, 12)}
+    cursor = encode_cursor(last, "timestamp")
+
+    query = page_filter({"offer_id": {"$in": [1]}}, params(cursor=cursor, sort="timestamp", since=datetime(2024, 5, 1)))
+
+    assert query == {"$and": [
+        {"offer_id": {"$in": [1]}},
+        {"timestamp": {"$gte": datetime(2024, 5, 1)}},
+        {"$or": [
+            {"timestamp": {"$gt": last["timestamp"]}},
+            {"timestamp": last["timestamp"], "_id": {"$gt": last["_id"]}},
+        ]},
+    ]}
+
+
+def test_cursors_are_checked():
+    last_id = ObjectId()
+    cursor = encode_cursor({"_id": last_id}, "_id")
+
+    assert page_filter({}, params(cursor=cursor)) == {"_id": {"$gt": last_id}}
+    with pytest.raises(HTTPException):
+        page_filter({}, params(cursor=cursor, sort="timestamp"))
+    with pytest.raises(HTTPException):
+        page_filter({}, params(cursor="not a cursor"))
+
+
+class MixedPayments(AsyncCollection):
+    """
+    Payments with timestamps not migrated yet, converted like $convert does
+    since mongomock doesn't implement it.
+    """
+
+    def aggregate(self, pipeline, **kwargs):
+        converted = mongomock.MongoClient().db.payments
+        for document in self.collection.find():
+            if isinstance(document["timestamp"], str):
+                try:
+                    document["timestamp"] = datetime.fromisoformat(document["timestamp"])
+                except ValueError:
+                    pass
+            converted.insert_one(document)
+        return AsyncCursor(converted.aggregate([stage for stage in pipeline if stage != LENIENT_TO_DATE_STAGE]))
+
+
+async def not_migrated(collection):
+    return False
+
+
+def walk(collection, **overrides):
+    documents, cursor = [], None
+    while True:
+        response = asyncio.run(paginate(collection, {}, None, params(limit=2, cursor=cursor, **overrides)))
+        documents.extend(json_util.loads(response.body))
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return [document["_id"] for document in documents]
+
+
+def test_timestamps_not_migrated_are_paged_as_dates(monkeypatch):
+    monkeypatch.setattr(pagination, "timestamps_migrated", not_migrated)
+    db = mongomock.MongoClient().db
+    db.payments.insert_many([
+        {"_id": 1, "timestamp": "2024-05-03T10:00:00"},
+        {"_id": 2, "timestamp": datetime(2022, 5, 1)},
+        {"_id": 3, "timestamp": "2022-06-01T10:00:00"},
+        {"_id": 4, "timestamp": datetime(2024, 5, 2)},
+        {"_id": 5, "timestamp": "2023-02-01T00:00:00"},
+        {"_id": 6, "timestamp": datetime(2023, 3, 1)},
+        {"_id": 7, "timestamp": "not a date"},
+    ])
+    payments = MixedPayments(db.payments)
+
+    assert walk(payments, sort="timestamp") == [2, 3, 5, 6, 4, 1]
+    assert walk(payments, since=datetime(2023, 1, 1)) == [1, 4, 5, 6]
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.api import series
+from app.db.provider_offers import ProviderOffers
+from app.tests.fakes import AsyncCursor
+
+
+class FakeCollection:
+    def __init__(self, rows=(), documents=()):
+        self.rows = list(rows)
+        self.documents = list(documents)
+        self.pipelines = []
+        self.queries = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return AsyncCursor(self.rows)
+
+    def find(self, query, projection):
+        self.queries.append(query)
+        return AsyncCursor(self.documents)
+
+
+async def no_stages(collection):
+    return []
+
+
+async def built(collection):
+    return True
+
+
+async def not_built(collection):
+    return False
+
+
+def test_payment_metrics_share_one_scan(monkeypatch):
+    payments = FakeCollection(rows=[
+        {"_id": datetime(2024, 5, 10), "num_payments": 3, "distinct_offers": [1, 2]},
+    ])
+    offers_current = FakeCollection(documents=[{"_id": 1}, {"_id": 2}])
+    monkeypatch.setattr(series, "repository", SimpleNamespace(payments=payments, offers_current=offers_current))
+    monkeypatch.setattr(series, "timestamp_stages", no_stages)
+    monkeypatch.setattr(series, "provider_offers", ProviderOffers())
+
+    result = asyncio.run(series.analysis_series(
+        ["num_payments", "distinct_offers"], "day", "p1", now=datetime(2024, 5, 10, 15)
+    ))
+
+    assert len(payments.pipelines) == 1
+    assert payments.pipelines[0][0] == {"$match": {"offer_id": {"$in": [1, 2]}}}
+    assert result["num_payments"][-1] == {"date": "10/05/2024", "count": 3}
+    assert result["distinct_offers"][-1] == {"date": "10/05/2024", "count": 2}
+    assert result["num_payments"][0] == {"date": "11/04/2024", "count": 0}
+    assert len(result["num_payments"]) == 30
+
+
+def test_rollup_metrics_are_read_from_the_rollups(monkeypatch):
+    rollups = FakeCollection(documents=[{"bucket": datetime(2024, 5, 10, 14), "count": 2, "amount": 30.0}])
+    monkeypatch.setattr(series, "repository", SimpleNamespace(rollups=rollups, payments=None))
+    monkeypatch.setattr(series, "rollups_built", built)
+
+    result = asyncio.run(series.analysis_series(["num_payments", "profit"], "hour", now=datetime(2024, 5, 10, 14, 30)))
+
+    assert len(rollups.queries) == 1
+    assert rollups.queries[0]["scope"] == "global"
+    assert result["num_payments"][-1] == {"date": "10/05/2024 14:00", "count": 2}
+    assert result["profit"][-1] == {"date": "10/05/2024 14:00", "count": 30.0}
+
+
+def test_payments_are_aggregated_until_the_rollups_are_built(monkeypatch):
+    rollups = FakeCollection()
+    payments = FakeCollection(rows=[{"_id": datetime(2024, 5, 10, 14), "num_payments": 5}])
+    monkeypatch.setattr(series, "repository", SimpleNamespace(rollups=rollups, payments=payments))
+    monkeypatch.setattr(series, "rollups_built", not_built)
+    monkeypatch.setattr(series, "timestamp_stages", no_stages)
+
+    result = asyncio.run(series.analysis_series(["num_payments"], "hour", now=datetime(2024, 5, 10, 14, 30)))
+
+    assert rollups.queries == []
+    assert len(payments.pipelines) == 1
+    assert result["num_payments"][-1] == {"date": "10/05/2024 14:00", "count": 5}
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.api import summary
+from app.tests.fakes import AsyncCursor
+
+
+class FakeCollection:
+    def __init__(self, output, rows=()):
+        self.output = output
+        self.rows = list(rows)
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        if "$facet" in pipeline[-1]:
+            return AsyncCursor([self.output])
+        return AsyncCursor(self.rows)
+
+
+async def no_stages(collection):
+    return []
+
+
+def test_cards_share_one_facet_per_collection(monkeypatch):
+    payments = FakeCollection({
+        "profit_this_month": [{"profit": 12.5}],
+        "number_of_sales_comparison_with_previous_month": [{"this_month": 3, "last_month": 5}],
+    })
+    offers = FakeCollection({})
+    monkeypatch.setattr(summary, "repository", SimpleNamespace(payments=payments, offers_current=offers))
+    monkeypatch.setattr(summary, "timestamp_stages", no_stages)
+
+    result = asyncio.run(summary.summary(
+        ["profit_this_month", "number_of_sales_comparison_with_previous_month", "total_number_of_offers"],
+        now=datetime(2024, 5, 10),
+    ))
+
+    assert result == {
+        "profit_this_month": [{"profit": 12.5}],
+        "number_of_sales_comparison_with_previous_month": -2,
+        "total_number_of_offers": [],
+    }
+    assert len(payments.pipelines) == len(offers.pipelines) == 1
+    assert offers.pipelines == [[{"$count": "total"}]]
+    # Only the months the selected cards need are scanned
+    assert payments.pipelines[0][0] == {"$match": {"timestamp": {"$gte": datetime(2024, 4, 1)}}}
+    assert list(payments.pipelines[0][1]["$facet"]) == [
+        "profit_this_month", "number_of_sales_comparison_with_previous_month",
+    ]
+
+
+def test_unbounded_cards_run_outside_the_facet(monkeypatch):
+    payments = FakeCollection({"number_of_sales_this_month": [{"total": 4}]}, rows=[{"_id": "PT", "num": 7}])
+    monkeypatch.setattr(summary, "repository", SimpleNamespace(payments=payments, offers_current=FakeCollection({})))
+    monkeypatch.setattr(summary, "timestamp_stages", no_stages)
+
+    result = asyncio.run(summary.summary(
+        ["number_of_sales_this_month", "number_of_payments_by_nationality"], now=datetime(2024, 5, 10),
+    ))
+
+    assert result == {
+        "number_of_sales_this_month": [{"total": 4}],
+        "number_of_payments_by_nationality": [{"_id": "PT", "num": 7}],
+    }
+    facet, nationality = payments.pipelines
+    assert facet[0] == {"$match": {"timestamp": {"$gte": datetime(2024, 5, 1)}}}
+    assert list(facet[1]["$facet"]) == ["number_of_sales_this_month"]
+    assert nationality == [{"$group": {"_id": "$nationality", "num": {"$sum": 1}}}]
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+from app.api.trends import NEUTRAL, TrendsStore
+
+
+class FakeSerpApi:
+    """
+    Stand-in for get_trends, answering with the given daily values.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+        self.fail = False
+
+    def __call__(self, term, date):
+        with self._lock:
+            self.calls.append((term, date))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            threading.Event().wait(0.01)
+            if self.fail:
+                raise ConnectionError("SerpAPI timed out")
+            return {"interest_over_time": {"timeline_data": [
+                {"values": [{"extracted_value": value}]} for value in self.values
+            ]}}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_requests_never_wait_on_serpapi():
+    serpapi = FakeSerpApi([10, 20, 40])
+    store = TrendsStore(fetch=serpapi, ttl=3600)
+
+    assert store.get("Aveiro", "days") == NEUTRAL
+    assert serpapi.calls == []
+
+    asyncio.run(store.refresh_due())
+    assert serpapi.calls == [("Aveiro", "today 1-m")]
+    # slopes 10 and 20, b 10 and 0
+    assert store.get("Aveiro", "days") == (15.0, 5.0)
+
+    asyncio.run(store.refresh_due())
+    assert len(serpapi.calls) == 1
+
+
+def test_stale_trends_are_served_while_refreshed():
+    serpapi = FakeSerpApi([10, 20, 40])
+    store = TrendsStore(fetch=serpapi, ttl=0)
+    asyncio.run(store.refresh("Aveiro", "days"))
+
+    serpapi.fail = True
+    asyncio.run(store.refresh("Aveiro", "days"))
+    assert store.get("Aveiro", "days") == (15.0, 5.0)
+
+    serpapi.fail = False
+    serpapi.values = [10, 10, 10]
+    asyncio.run(store.refresh("Aveiro", "days"))
+    assert store.get("Aveiro", "days") == (0.0, 10.0)
+
+
+def test_refreshes_are_limited():
+    serpapi = FakeSerpApi([10, 20, 40] * 10)
+    store = TrendsStore(fetch=serpapi, ttl=3600, concurrency=1)
+    for term in ("Aveiro", "Porto", "Lisboa"):
+        store.prewarm(term)
+
+    asyncio.run(store.refresh_due())
+    assert len(serpapi.calls) == 6
+    assert serpapi.max_running == 1
+
+
+def test_failed_refreshes_back_off():
+    serpapi = FakeSerpApi([10, 20, 40])
+    serpapi.fail = True
+    store = TrendsStore(fetch=serpapi, ttl=3600, retry_backoff=3600)
+    store.prewarm("Aveiro")
+
+    asyncio.run(store.refresh_due())
+    asyncio.run(store.refresh_due())
+    assert len(serpapi.calls) == 2
+
+    serpapi.fail = False
+    store.retry_backoff = 0
+    asyncio.run(store.refresh_due())
+    assert len(serpapi.calls) == 4
+    assert store.get("Aveiro", "days") == (15.0, 5.0)
@@ -0,0 +1,59 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.buckets import GRANULARITIES, STEPS, bucket_start, calendar, fill, label
+
+# Sampled instead of enumerated: random instants over several years,
+# including month ends, leap days and year boundaries
+random.seed(12)
+NOWS = [datetime(2023, 1, 1) + timedelta(minutes=random.randint(0, 60 * 24 * 365 * 3)) for _ in range(300)]
+NOWS += [datetime(2024, 2, 29, 23, 59), datetime(2024, 3, 31, 12), datetime(2024, 12, 31, 23, 30)]
+
+
+def legacy_fill(results, now, periods, step, date_format):
+    # The gap filling the series functions did before the bucket calendar
+    all_periods = [(now - step * i).strftime(date_format) for i in range(periods)]
+    for period in all_periods:
+        if not any(result['date'] == period for result in results):
+            results.append({'count': 0, 'date': period})
+    results.sort(key=lambda result: datetime.strptime(result['date'], date_format))
+    return results
+
+
+@pytest.mark.parametrize("granularity, step, date_format", [
+    ("day", timedelta(days=1), "%d/%m/%Y"),
+    ("hour", timedelta(hours=1), "%d/%m/%Y %H:00"),
+])
+def test_fill_matches_the_legacy_gap_filling(granularity, step, date_format):
+    for now in NOWS:
+        buckets = calendar(granularity, now)
+        values = {bucket: random.randint(1, 9) for bucket in random.sample(buckets, 5)}
+        results = [{"date": label(bucket, granularity), "count": count} for bucket, count in values.items()]
+
+        assert fill(buckets, granularity, values) == legacy_fill(results, now, len(buckets), step, date_format)
+
+
+@pytest.mark.parametrize("granularity", GRANULARITIES)
+def test_calendar_is_consecutive_and_ends_at_now(granularity):
+    for now in NOWS:
+        buckets = calendar(granularity, now)
+
+        assert buckets[-1] <= now < buckets[-1] + STEPS[granularity]
+        assert all(later == earlier + STEPS[granularity] for earlier, later in zip(buckets, buckets[1:]))
+        assert all(bucket_start(bucket, granularity) == bucket for bucket in buckets)
+        assert len({label(bucket, granularity) for bucket in buckets}) == len(buckets)
+
+
+def test_month_calendar_has_every_month_once():
+    labels = [label(bucket, "month") for bucket in calendar("month", datetime(2024, 3, 31, 12))]
+
+    assert labels == ["04/2023", "05/2023", "06/2023", "07/2023", "08/2023", "09/2023",
+                      "10/2023", "11/2023", "12/2023", "01/2024", "02/2024", "03/2024"]
+
+
+def test_weeks_and_quarters():
+    assert bucket_start(datetime(2024, 5, 12, 18), "week") == datetime(2024, 5, 6)
+    assert bucket_start(datetime(2024, 5, 12, 18), "quarter") == datetime(2024, 4, 1)
+    assert label(datetime(2024, 10, 1), "quarter") == "Q4/2024"
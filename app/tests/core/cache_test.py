@@ -0,0 +1,86 @@
+import asyncio
+
+import mongomock
+
+from app.core.cache import DataVersions, MemoryBackend, ResultCache
+
+
+def test_entries_are_dropped_when_their_scope_changes():
+    versions = DataVersions()
+    cache = ResultCache(MemoryBackend(size=10, ttl=60), versions)
+    computed = []
+
+    async def compute():
+        computed.append(1)
+        return {"count": len(computed)}
+
+    def body():
+        return asyncio.run(cache.get_or_compute("a", "provider:p1", compute)).body
+
+    assert body() == b'{"count":1}'
+    assert body() == b'{"count":1}'
+
+    asyncio.run(versions.bump(None, ["global", "provider:p2"]))
+    assert body() == b'{"count":1}'
+
+    asyncio.run(versions.bump(None, ["global", "provider:p1"]))
+    assert body() == b'{"count":2}'
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_memory_backend_evicts_and_expires():
+    backend = MemoryBackend(size=2, ttl=60)
+    for key in ("a", "b", "c"):
+        asyncio.run(backend.set(key, 0, key.encode()))
+
+    assert asyncio.run(backend.get("a")) is None
+    assert asyncio.run(backend.get("c")) == (0, b"c")
+
+    expired = MemoryBackend(size=2, ttl=0)
+    asyncio.run(expired.set("a", 0, b"a"))
+    assert asyncio.run(expired.get("a")) is None
+
+
+def test_conditional_requests_are_answered_before_the_endpoint_runs(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.core import cache as cache_module
+
+    versions = DataVersions()
+    monkeypatch.setattr(cache_module, "result_cache", ResultCache(MemoryBackend(size=10, ttl=60), versions))
+    calls = []
+    app = FastAPI()
+
+    @app.get("/count")
+    @cache_module.cached(lambda kwargs: "global")
+    async def count(tag: str = "all"):
+        calls.append(tag)
+        return {"count": len(calls)}
+
+    client = TestClient(app)
+    response = client.get("/count")
+    etag = response.headers["ETag"]
+    assert response.json() == {"count": 1}
+    assert response.headers["Last-Modified"]
+
+    assert client.get("/count", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/count", headers={"If-Modified-Since": response.headers["Last-Modified"]}).status_code == 304
+    assert client.get("/count?tag=food", headers={"If-None-Match": etag}).status_code == 200
+
+    asyncio.run(versions.bump(None, ["global"]))
+    response = client.get("/count", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert calls == ["all", "food", "all"]
+
+
+def test_maintenance_commands_bump_only_shared_versions():
+    db = mongomock.MongoClient().db
+
+    assert not DataVersions().bump_shared(db, ["global"])
+    assert DataVersions("data_versions").bump_shared(db, ["global", "provider:p1"])
+    assert DataVersions("data_versions").bump_shared(db, ["global"])
+
+    versions = {version["_id"]: version["version"] for version in db.data_versions.find()}
+    assert versions == {"global": 2, "provider:p1": 1}
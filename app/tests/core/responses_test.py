@@ -0,0 +1,31 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from bson import Decimal128, Int64, ObjectId, json_util
+
+from app.core.responses import dumps
+
+
+def previous_response(content):
+    # What the endpoints sent with json.loads(json_util.dumps(...)) and JSONResponse
+    return json.dumps(
+        json.loads(json_util.dumps(content)), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode()
+
+
+def test_bson_values_are_written_as_relaxed_extended_json():
+    content = [{
+        "_id": ObjectId(),
+        "offer_id": Int64(2**40),
+        "amount": 12.5,
+        "price": Decimal128("19.99"),
+        "name": "Passeio de moliceiro em Águeda",
+        "timestamp": datetime(2024, 5, 17, 14, 32, 10, 123456),
+        "whole_second": datetime(2024, 5, 17, 14, 32, 10),
+        "aware": datetime(2024, 5, 17, 14, 32, tzinfo=timezone(timedelta(hours=1))),
+        "utc": datetime(2024, 5, 17, 14, 32, tzinfo=timezone.utc),
+        "old": datetime(1960, 1, 1),
+        "offer": {"userid": None, "tags": ["boat", "culture"]},
+    }]
+
+    assert dumps(content) == previous_response(content)
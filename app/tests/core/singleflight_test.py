@@ -0,0 +1,40 @@
+import asyncio
+
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def query():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        return await asyncio.gather(*(flight.do("analysis", query) for _ in range(5)))
+
+    assert asyncio.run(main()) == [1] * 5
+    assert flight.collapsed == 4
+    # Done calls are not shared
+    assert asyncio.run(flight.do("analysis", query)) == 2
+
+
+def test_errors_are_shared_and_not_kept():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("aggregation failed")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("analysis", failing) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [type(error) for error in errors] == [ValueError] * 3
+
+    async def succeeding():
+        return 1
+
+    assert asyncio.run(flight.do("analysis", succeeding)) == 1
@@ -0,0 +1,11 @@
+from app.db.indexes import _has_collscan
+
+
+def test_has_collscan_ignores_rejected_plans():
+    explain = {"stages": [{"$cursor": {"queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}],
+    }}}]}
+
+    assert not _has_collscan(explain)
+    assert _has_collscan({"queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}})
@@ -0,0 +1,231 @@
+import asyncio
+from datetime import datetime
+
+import mongomock
+import pytest
+
+from app.db import migrations
+from app.db.init_db import PAYMENTS_TIMESERIES
+from app.db.migrations import TO_DATE_STAGE, migrate_payments_to_timeseries, migrate_timestamps, timestamp_stages
+from app.tests.fakes import AsyncCollection
+
+
+class UpdateResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class Payments:
+    """
+    A mongomock collection converting timestamps like $convert does, which
+    mongomock doesn't implement. `fail_after` updates it raises.
+    """
+
+    def __init__(self, collection, fail_after=None):
+        self.collection = collection
+        self.name = collection.name
+        self.database = collection.database
+        self.fail_after = fail_after
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append(query)
+        return self.collection.find(query, projection)
+
+    def count_documents(self, query):
+        return self.collection.count_documents(query)
+
+    def update_many(self, query, pipeline):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise ConnectionError("interrupted")
+            self.fail_after -= 1
+        assert pipeline[0]["$set"]["timestamp"]["$convert"]["onError"] == "$timestamp"
+        modified = 0
+        for document in self.collection.find(query):
+            try:
+                timestamp = datetime.fromisoformat(document["timestamp"])
+            except ValueError:
+                continue
+            self.collection.update_one({"_id": document["_id"]}, {"$set": {"timestamp": timestamp}})
+            modified += 1
+        return UpdateResult(modified)
+
+
+def seed(db):
+    db.payments.insert_many([
+        {"_id": 1, "timestamp": "2024-05-01T10:00:00"},
+        {"_id": 2, "timestamp": datetime(2024, 5, 1, 11)},
+        {"_id": 3, "timestamp": "2024-05-01T12:00:00"},
+        {"_id": 4, "timestamp": "not a date"},
+        {"_id": 5, "timestamp": "2024-05-01T13:30:00"},
+    ])
+
+
+def test_an_interrupted_migration_resumes_from_its_checkpoint():
+    db = mongomock.MongoClient().db
+    seed(db)
+
+    with pytest.raises(ConnectionError):
+        migrate_timestamps(Payments(db.payments, fail_after=1), batch_size=2)
+    assert db.migrations.find_one()["last_id"] == 3
+
+    payments = Payments(db.payments)
+    result = migrate_timestamps(payments, batch_size=2)
+
+    # Documents before the checkpoint are not read again
+    assert payments.queries[0]["_id"] == {"$gt": 3}
+    assert result == {"converted": 3, "remaining": 1}
+    assert db.payments.find_one({"_id": 5})["timestamp"] == datetime(2024, 5, 1, 13, 30)
+
+
+def test_strings_that_are_not_dates_are_left_and_reported():
+    db = mongomock.MongoClient().db
+    seed(db)
+
+    result = migrate_timestamps(Payments(db.payments), batch_size=10)
+
+    assert result == {"converted": 3, "remaining": 1}
+    assert db.payments.find_one({"_id": 4})["timestamp"] == "not a date"
+    assert db.migrations.find_one()["done"] is False
+
+    db.payments.delete_one({"_id": 4})
+    assert migrate_timestamps(Payments(db.payments))["remaining"] == 0
+    assert db.migrations.find_one()["done"] is True
+
+
+def test_timestamp_stages_are_dropped_once_the_migration_is_done(monkeypatch):
+    monkeypatch.setattr(migrations, "_finished", set())
+    monkeypatch.setattr(migrations, "_last_check", {})
+    clock = [1000.0]
+    monkeypatch.setattr(migrations.time, "monotonic", lambda: clock[0])
+    db = mongomock.MongoClient().db
+    payments = AsyncCollection(db.payments)
+
+    assert asyncio.run(timestamp_stages(payments)) == [TO_DATE_STAGE]
+
+    db.migrations.insert_one({"_id": migrations._migration_id(payments), "done": True})
+    # Not checked again before the interval
+    assert asyncio.run(timestamp_stages(payments)) == [TO_DATE_STAGE]
+
+    clock[0] += migrations._RECHECK_INTERVAL
+    assert asyncio.run(timestamp_stages(payments)) == []
+    # Remembered for the life of the process
+    db.migrations.delete_many({})
+    assert asyncio.run(timestamp_stages(payments)) == []
+
+
+def convert(document):
+    timestamp = document["timestamp"]
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except ValueError:
+            timestamp = None
+    return {**document, "timestamp": timestamp}
+
+
+class TimeseriesCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.collection = database.db[name]
+        self.name = name
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def aggregate(self, pipeline):
+        # The $convert of the timestamps is applied here
+        assert "$convert" in pipeline[-1]["$addFields"]["timestamp"]
+        return [convert(document) for document in self.collection.aggregate(pipeline[:-1])]
+
+    def rename(self, name):
+        self.collection.rename(name)
+        self.database.renamed(self.name, name)
+
+
+class TimeseriesDatabase:
+    """
+    A mongomock database remembering which of its collections were
+    created as time-series ones, which mongomock doesn't support.
+    """
+
+    def __init__(self):
+        self.db = mongomock.MongoClient().db
+        self.timeseries = {}
+        self.on_rename = None
+
+    def __getitem__(self, name):
+        return TimeseriesCollection(self, name)
+
+    def list_collection_names(self):
+        return self.db.list_collection_names()
+
+    def list_collections(self, filter):
+        names = [name for name in self.db.list_collection_names() if name == filter["name"]]
+        return [{"name": name, "type": "timeseries" if name in self.timeseries else "collection"} for name in names]
+
+    def create_collection(self, name, timeseries):
+        self.db.create_collection(name)
+        self.timeseries[name] = timeseries
+
+    def renamed(self, old, new):
+        if self.on_rename is not None:
+            self.on_rename(old, new)
+
+
+def seed_payments(db, number):
+    db.db.payments.insert_many([
+        {"_id": i, "offer_id": i % 3, "amount": 1.0, "timestamp": f"2024-05-01T{i % 24:02}:00:00"}
+        for i in range(number)
+    ])
+
+
+def test_payments_are_copied_newest_first_into_an_indexed_timeseries_collection(monkeypatch):
+    db = TimeseriesDatabase()
+    seed_payments(db, 7)
+    db.db.payments.insert_one({"_id": 7, "offer_id": 0, "timestamp": "not a date"})
+    copied = []
+    insert_many = mongomock.collection.Collection.insert_many
+
+    def record(self, documents, ordered=True):
+        copied.append([document["_id"] for document in documents])
+        return insert_many(self, documents, ordered=ordered)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_many", record)
+    result = migrate_payments_to_timeseries(db, batch_size=3, quiet_seconds=0)
+
+    assert result == {"copied": 7, "skipped": 1}
+    assert db.timeseries == {"payments": PAYMENTS_TIMESERIES}
+    assert copied == [[6, 5], [4, 3, 2], [1, 0]]
+    assert db.db.payments.find_one({"_id": 6})["timestamp"] == datetime(2024, 5, 1, 6)
+    assert db.db.payments_regular.count_documents({}) == 8
+    indexes = [list(index["key"]) for index in db.db.payments.index_information().values()]
+    assert [("offer_id", 1), ("timestamp", -1)] in indexes
+
+
+def test_the_migration_waits_for_the_consumer_to_stop(monkeypatch):
+    db = TimeseriesDatabase()
+    seed_payments(db, 3)
+    # A payment stored while the migration checks for new payments
+    monkeypatch.setattr(migrations.time, "sleep", lambda seconds: db.db.payments.insert_one({"_id": 99}))
+
+    with pytest.raises(RuntimeError, match="stop the consumer"):
+        migrate_payments_to_timeseries(db, quiet_seconds=1)
+
+    assert db.list_collection_names() == ["payments"]
+    assert db.db.payments.count_documents({}) == 4
+
+
+def test_payments_stored_during_the_swap_undo_it():
+    db = TimeseriesDatabase()
+    seed_payments(db, 3)
+    # The consumer stores a payment right after the rename, recreating a regular payments
+    db.on_rename = lambda old, new: old == "payments" and db.db.payments.insert_one({"_id": 99})
+
+    with pytest.raises(RuntimeError, match="stop the consumer"):
+        migrate_payments_to_timeseries(db, quiet_seconds=0)
+
+    assert db.list_collection_names() == ["payments"]
+    assert db.timeseries == {}
+    assert sorted(document["_id"] for document in db.db.payments.find()) == [0, 1, 2, 99]
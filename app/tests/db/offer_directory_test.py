@@ -0,0 +1,62 @@
+import asyncio
+
+from app.db import offer_directory
+from app.db.offer_directory import OfferDirectory
+
+
+class FakeOffersCollection:
+    def __init__(self, offers):
+        self.offers = offers
+        self.lookups = 0
+
+    async def find_one(self, query, projection, sort):
+        self.lookups += 1
+        versions = [offer for offer in self.offers if offer["id"] == query["id"]]
+        return versions[-1] if versions else None
+
+
+def test_enrich_uses_latest_offer_version_and_looks_up_misses_once():
+    collection = FakeOffersCollection([{"id": 2, "userid": "p2", "tags": ["food"]}])
+    directory = OfferDirectory()
+    directory._collection = collection
+    directory.update({"id": 1, "userid": "p1", "tags": ["beach"]})
+    directory.update({"id": 1, "userid": "p1", "tags": ["beach", "surf"]})
+
+    async def run():
+        return [
+            await directory.enrich({"offer_id": 1}),
+            await directory.enrich({"offer_id": 2}),
+            await directory.enrich({"offer_id": 2}),
+            await directory.enrich({"offer_id": 3}),
+        ]
+
+    payments = asyncio.run(run())
+
+    assert payments[0]["offer"] == {"userid": "p1", "tags": ["beach", "surf"]}
+    assert payments[1]["offer"] == payments[2]["offer"] == {"userid": "p2", "tags": ["food"]}
+    assert "offer" not in payments[3]
+    assert collection.lookups == 2
+
+
+def test_unknown_offers_are_not_looked_up_again_until_their_ttl(monkeypatch):
+    collection = FakeOffersCollection([])
+    directory = OfferDirectory()
+    directory._collection = collection
+    clock = [100.0]
+    monkeypatch.setattr(offer_directory.time, "monotonic", lambda: clock[0])
+
+    async def resolve():
+        return await directory.resolve(9)
+
+    assert asyncio.run(resolve()) is None
+    assert asyncio.run(resolve()) is None
+    assert collection.lookups == 1
+
+    clock[0] += offer_directory.MISSING_OFFER_TTL
+    assert asyncio.run(resolve()) is None
+    assert collection.lookups == 2
+
+    # Known as soon as the offer consumer stores it
+    directory.update({"id": 9, "userid": "p9", "tags": []})
+    assert asyncio.run(resolve()) == {"userid": "p9", "tags": []}
+    assert collection.lookups == 2
@@ -0,0 +1,83 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import mongomock
+
+from app.core.buckets import STEPS, calendar
+from app.db.offer_index import count_offers_first_seen_before, store_offer_index
+from app.tests.fakes import AsyncCollection, AsyncDatabase
+
+
+def version(offer_id, day, userid, tags):
+    return {"id": offer_id, "timestamp": datetime(2024, 5, day), "userid": userid, "tags": tags}
+
+
+def store(db, *batches):
+    for batch in batches:
+        asyncio.run(store_offer_index(AsyncDatabase(db), batch))
+    return {offer["_id"]: offer for offer in db.offers_current.find()}
+
+
+def test_first_seen_is_kept_when_newer_versions_arrive():
+    offers = store(mongomock.MongoClient().db, [version(1, 2, "p1", ["food"])], [version(1, 5, "p1", ["food"])])
+
+    assert offers[1]["first_seen"] == datetime(2024, 5, 2)
+    assert offers[1]["last_seen"] == datetime(2024, 5, 5)
+
+
+def test_versions_merged_out_of_order_keep_the_newest_owner_and_tags():
+    offers = store(
+        mongomock.MongoClient().db,
+        [version(1, 5, "p1", ["surf"])],
+        # Redelivered and late versions are older than the stored one
+        [version(1, 2, "p1", ["food"]), version(1, 3, "p1", ["beach"])],
+        [version(1, 5, "p1", ["surf"])],
+    )
+
+    assert offers[1]["first_seen"] == datetime(2024, 5, 2)
+    assert offers[1]["last_seen"] == datetime(2024, 5, 5)
+    assert offers[1]["tags"] == ["surf"]
+
+
+def test_an_offer_moves_to_its_new_owner():
+    db = mongomock.MongoClient().db
+    offers = store(db, [version(1, 2, "p1", []), version(2, 2, "p1", [])], [version(1, 4, "p2", [])])
+
+    assert offers[1]["userid"] == "p2"
+    assert offers[1]["first_seen"] == datetime(2024, 5, 2)
+    assert db.offers_current.count_documents({"userid": "p1"}) == 1
+
+
+def test_cumulative_counts_match_one_count_per_bucket():
+    offers = mongomock.MongoClient().db.offers_current
+    random.seed(7)
+    now = datetime(2024, 5, 10, 23, 40)
+    offers.insert_many([
+        {"_id": i, "userid": f"p{i % 3}", "first_seen": now - timedelta(minutes=random.randint(0, 60 * 30))}
+        for i in range(500)
+    ])
+    # First seen during the 23:00 bucket, and exactly on its boundaries
+    offers.insert_many([
+        {"_id": "late", "userid": "p0", "first_seen": datetime(2024, 5, 10, 23, 30)},
+        {"_id": "on the hour", "userid": "p0", "first_seen": datetime(2024, 5, 10, 23)},
+        {"_id": "midnight", "userid": "p0", "first_seen": datetime(2024, 5, 11)},
+    ])
+
+    for granularity in ("hour", "day"):
+        boundaries = [bucket + STEPS[granularity] for bucket in calendar(granularity, now)]
+        for query in (None, {"userid": "p0"}):
+            totals = asyncio.run(count_offers_first_seen_before(AsyncCollection(offers), boundaries, query))
+            expected = [
+                offers.count_documents({**(query or {}), "first_seen": {"$lt": boundary}})
+                for boundary in boundaries
+            ]
+            assert totals == expected
+
+    # The 23:00 point counts the offers of that hour, up to midnight
+    boundaries = [bucket + STEPS["hour"] for bucket in calendar("hour", now)]
+    totals = asyncio.run(count_offers_first_seen_before(AsyncCollection(offers), boundaries, {"userid": "p0"}))
+    assert boundaries[-1] == datetime(2024, 5, 11)
+    in_last_hour = offers.count_documents({"userid": "p0", "first_seen": {"$gte": datetime(2024, 5, 10, 23),
+                                                                         "$lt": datetime(2024, 5, 11)}})
+    assert totals[-1] - totals[-2] == in_last_hour >= 2
@@ -0,0 +1,44 @@
+import asyncio
+
+from app.db.provider_offers import ProviderOffers
+from app.tests.fakes import AsyncCursor
+
+
+class FakeOffersCurrent:
+    def __init__(self, offers):
+        self.offers = offers
+        self.finds = 0
+        self.on_find = None
+
+    def find(self, query, projection):
+        self.finds += 1
+        if self.on_find:
+            self.on_find()
+        return AsyncCursor({"_id": offer["_id"]} for offer in self.offers if offer["userid"] == query["userid"])
+
+
+def test_offer_ids_are_cached_until_invalidated():
+    collection = FakeOffersCurrent([{"_id": 1, "userid": "p1"}, {"_id": 2, "userid": "p2"}])
+    provider_offers = ProviderOffers()
+
+    assert asyncio.run(provider_offers.match(collection, "p1")) == {"$match": {"offer_id": {"$in": [1]}}}
+    assert asyncio.run(provider_offers.offer_ids(collection, "p1")) == [1]
+    assert collection.finds == 1
+
+    collection.offers.append({"_id": 3, "userid": "p1"})
+    provider_offers.invalidate(["p1"])
+
+    assert asyncio.run(provider_offers.offer_ids(collection, "p1")) == [1, 3]
+    assert collection.finds == 2
+
+
+def test_ids_read_during_an_invalidation_are_not_cached():
+    collection = FakeOffersCurrent([{"_id": 1, "userid": "p1"}])
+    provider_offers = ProviderOffers()
+    collection.on_find = lambda: provider_offers.invalidate(["p1"])
+
+    asyncio.run(provider_offers.offer_ids(collection, "p1"))
+    collection.on_find = None
+    asyncio.run(provider_offers.offer_ids(collection, "p1"))
+
+    assert collection.finds == 2
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+
+import mongomock
+
+from app.db import rollups
+from app.db.rollups import rebuild_rollups, rollup_totals, rollup_updates, rollups_built
+from app.tests.fakes import AsyncCollection, AsyncCursor
+
+
+class FakeRollupsCollection:
+    def __init__(self, rollups):
+        self.rollups = rollups
+
+    def find(self, query, projection):
+        bucket = query["bucket"]
+        return AsyncCursor(
+            rollup for rollup in self.rollups
+            if rollup["scope"] == query["scope"]
+            and rollup["granularity"] == query["granularity"]
+            and bucket["$gte"] <= rollup["bucket"] <= bucket["$lte"]
+        )
+
+
+def test_rollup_updates_combine_payments_per_bucket():
+    payments = [
+        {"amount": 10.0, "timestamp": datetime(2024, 5, 1, 10, 5), "offer": {"userid": "p1"}},
+        {"amount": 5.0, "timestamp": datetime(2024, 5, 1, 10, 55), "offer": {"userid": "p1"}},
+        {"amount": 1.0, "timestamp": datetime(2024, 5, 2, 9, 0)},
+    ]
+
+    updates = {
+        tuple(update._filter.values()): update._doc["$inc"]
+        for update in rollup_updates(payments)
+    }
+
+    assert updates[("global", "hour", datetime(2024, 5, 1, 10))] == {"count": 2, "amount": 15.0}
+    assert updates[("provider:p1", "day", datetime(2024, 5, 1))] == {"count": 2, "amount": 15.0}
+    assert updates[("global", "month", datetime(2024, 5, 1))] == {"count": 3, "amount": 16.0}
+    assert ("provider:p1", "day", datetime(2024, 5, 2)) not in updates
+    assert len(updates) == 8
+
+
+def test_rollup_totals_read_the_buckets_of_the_window():
+    collection = FakeRollupsCollection([
+        {"scope": "global", "granularity": "month", "bucket": datetime(2024, 3, 1), "amount": 7.5},
+        {"scope": "global", "granularity": "month", "bucket": datetime(2023, 3, 1), "amount": 99.0},
+        {"scope": "provider:p1", "granularity": "month", "bucket": datetime(2024, 3, 1), "amount": 1.0},
+    ])
+
+    totals = asyncio.run(rollup_totals(collection, "global", "month", datetime(2023, 4, 1), datetime(2024, 3, 1),
+                                       ["amount"]))
+
+    assert list(totals) == [datetime(2024, 3, 1)]
+    assert totals[datetime(2024, 3, 1)]["amount"] == 7.5
+
+
+def test_rollups_are_built_once_rebuilt(monkeypatch):
+    db = mongomock.MongoClient().db
+    clock = [0.0]
+    monkeypatch.setattr(rollups.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(rollups, "_built", set())
+    monkeypatch.setattr(rollups, "_last_check", {})
+
+    rebuild_rollups(db.payments, db.payment_rollups, check_only=True)
+    assert not asyncio.run(rollups_built(AsyncCollection(db.payment_rollups)))
+
+    rebuild_rollups(db.payments, db.payment_rollups)
+    # Not checked again before the interval
+    assert not asyncio.run(rollups_built(AsyncCollection(db.payment_rollups)))
+    clock[0] += rollups._RECHECK_INTERVAL
+    assert asyncio.run(rollups_built(AsyncCollection(db.payment_rollups)))
@@ -0,0 +1,69 @@
+class AsyncCursor:
+    """
+    Documents returned the way a motor cursor returns them.
+    """
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while self.documents:
+            yield self.documents.pop(0)
+
+    async def to_list(self, length=None):
+        length = len(self.documents) if length is None else length
+        documents, self.documents = self.documents[:length], self.documents[length:]
+        return documents
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+
+class AsyncCollection:
+    """
+    A pymongo collection, mongomock's in the tests, used the way a motor
+    collection is.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.full_name = collection.full_name
+        self.database = AsyncDatabase(collection.database)
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return AsyncCursor(self.collection.aggregate(pipeline))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.db[name])
+
+    async def list_collections(self, filter=None):
+        # mongomock has no list_collections and no time-series collections
+        names = self.db.list_collection_names()
+        return AsyncCursor(
+            {"name": name, "type": "collection"}
+            for name in names if filter is None or name == filter["name"]
+        )
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pytest
+
+from app.rabbitmq.decoding import DecodeError, decode_offer, decode_payment
+
+
+def test_decode_payment_converts_timestamp_and_amount():
+    payment = decode_payment(
+        b'{"offer_id": 7, "amount": "12.50", "nationality": "PT", "timestamp": "2024-05-01T10:00:00+01:00"}'
+    )
+
+    assert payment == {
+        "offer_id": 7,
+        "amount": 12.5,
+        "nationality": "PT",
+        "timestamp": datetime(2024, 5, 1, 9, 0),
+    }
+
+
+def test_decode_offer_accepts_python_literal_bodies():
+    offer = decode_offer(b"{'id': 1, 'userid': 'u1', 'tags': ['beach'], 'timestamp': '2024-05-01 10:00:00'}")
+
+    assert offer["tags"] == ["beach"]
+    assert offer["timestamp"] == datetime(2024, 5, 1, 10, 0)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"offer_id": 7, "amount": "free", "timestamp": "2024-05-01T10:00:00"}',
+    b'{"offer_id": 7, "amount": 1}',
+    b"__import__('os').system('true')",
+    b"not a message",
+])
+def test_decode_payment_rejects_malformed_bodies(body):
+    with pytest.raises(DecodeError):
+        decode_payment(body)
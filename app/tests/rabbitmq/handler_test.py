@@ -0,0 +1,249 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import mongomock
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from app.core.metrics import metrics
+from app.rabbitmq import handler
+from app.rabbitmq.handler import (BatchWriter, DeadLetterQueue, enrich_payments, offers_embeddable, on_message_payment,
+                                  store_offers, store_payments)
+from app.tests.fakes import AsyncCursor, AsyncDatabase
+
+
+class FakeMessage:
+    def __init__(self, delivery_tag, channel=None):
+        self.delivery_tag = delivery_tag
+        self.channel = channel or SimpleNamespace(is_closed=False)
+        self.acks = []
+        self.nacks = []
+
+    async def ack(self, multiple=False):
+        self.acks.append(multiple)
+
+    async def nack(self, multiple=False, requeue=True):
+        self.nacks.append((multiple, requeue))
+
+
+class FakeCollection:
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    async def insert_many(self, documents, ordered):
+        if self.error:
+            raise self.error
+        self.batches.append((documents, ordered))
+
+
+def test_batch_writer_flushes_on_size_with_one_multi_ack():
+    collection = FakeCollection()
+    writer = BatchWriter("payment", collection, max_size=3, max_interval=60)
+    messages = [FakeMessage(tag) for tag in range(1, 5)]
+
+    async def run():
+        for message in messages:
+            await writer.add(message, {"n": message.delivery_tag})
+
+    asyncio.run(run())
+
+    assert collection.batches == [([{"n": 1}, {"n": 2}, {"n": 3}], False)]
+    assert [message.acks for message in messages] == [[], [], [True], []]
+    assert writer.documents == [{"n": 4}]
+
+
+def test_batch_writer_never_acks_past_a_delivery_still_handled():
+    collection = FakeCollection()
+    writer = BatchWriter("payment", collection, max_size=3, max_interval=60)
+    messages = {tag: FakeMessage(tag) for tag in range(1, 5)}
+    enriched = asyncio.Event()
+
+    async def handle(tag, delay=None):
+        if delay is not None:
+            # A slow enrichment: later deliveries reach the buffer first
+            await delay.wait()
+        await writer.add(messages[tag], {"n": tag})
+
+    async def run():
+        slow = asyncio.create_task(handle(1, enriched))
+        for tag in (2, 3, 4):
+            await handle(tag)
+        assert [message.acks for message in messages.values()] == [[], [], [], []]
+        enriched.set()
+        await slow
+        await writer.flush()
+
+    asyncio.run(run())
+
+    assert [documents for documents, _ in collection.batches] == [[{"n": 2}, {"n": 3}, {"n": 4}], [{"n": 1}]]
+    # Tag 1 is covered by the single multi-ack sent once it is stored
+    assert [message.acks for message in messages.values()] == [[], [], [], [True]]
+
+
+class SlowDirectory:
+    """
+    Offer directory whose lookups take until `found` is set.
+    """
+
+    def __init__(self):
+        self.found = asyncio.Event()
+
+    async def enrich(self, payment):
+        await self.found.wait()
+        payment["offer"] = {"userid": "p1", "tags": []}
+        return payment
+
+
+def test_payments_are_buffered_in_delivery_order_and_enriched_when_written(monkeypatch):
+    directory = SlowDirectory()
+    monkeypatch.setattr(handler, "offer_directory", directory)
+    collection = FakeCollection()
+    writer = BatchWriter("payment", collection, max_size=10, max_interval=60, prepare=enrich_payments)
+    messages = [FakeMessage(tag) for tag in (1, 2)]
+    for message in messages:
+        message.body = f'{{"offer_id": {message.delivery_tag}, "amount": 1, "timestamp": "2024-05-01"}}'.encode()
+
+    async def run():
+        for message in messages:
+            await on_message_payment(writer, None, message)
+        assert [payment["offer_id"] for payment in writer.documents] == [1, 2]
+        flush = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        directory.found.set()
+        await flush
+
+    asyncio.run(run())
+
+    documents, _ = collection.batches[0]
+    assert [payment["offer"]["userid"] for payment in documents] == ["p1", "p1"]
+    assert [message.acks for message in messages] == [[], [True]]
+
+
+class FakeChannel:
+    def __init__(self, error=None):
+        self.published = []
+        self.error = error
+        self.default_exchange = self
+
+    async def publish(self, message, routing_key):
+        if self.error:
+            raise self.error
+        self.published.append(routing_key)
+
+
+def test_dead_letters_are_settled_in_order_with_the_batches():
+    writer = BatchWriter("payment", FakeCollection(), max_size=10, max_interval=60)
+    dead_letters = DeadLetterQueue("payment", FakeChannel(ConnectionError("closed")), writer.settlements)
+    messages = {tag: FakeMessage(tag) for tag in range(1, 5)}
+    messages[2].body = b"{"
+
+    async def run():
+        await writer.add(messages[3], {"n": 3})
+        await writer.add(messages[4], {"n": 4})
+        await writer.flush()
+        await dead_letters.publish(messages[2], ValueError("not json"))
+        assert [(message.acks, message.nacks) for message in messages.values()] == [([], [])] * 4
+        await writer.add(messages[1], {"n": 1})
+        await writer.flush()
+
+    asyncio.run(run())
+
+    # Tag 1 acked, 2 rejected, then 3 and 4 acked
+    assert [(message.acks, message.nacks) for message in messages.values()] == [
+        ([True], []), ([], [(True, False)]), ([], []), ([True], []),
+    ]
+
+
+def test_batch_writer_requeues_batch_when_insert_fails():
+    writer = BatchWriter("payment", FakeCollection(AutoReconnect("down")), max_size=10, max_interval=60)
+    messages = [FakeMessage(1), FakeMessage(2)]
+
+    async def run():
+        for message in messages:
+            await writer.add(message, {"n": message.delivery_tag})
+        await writer.flush()
+
+    asyncio.run(run())
+
+    assert messages[1].acks == []
+    assert messages[1].nacks == [(True, True)]
+    assert writer.documents == []
+
+
+def test_batch_writer_counts_only_the_stored_documents():
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000}]})
+    stored = []
+
+    async def on_stored(documents):
+        stored.extend(documents)
+
+    writer = BatchWriter("partial", FakeCollection(error), max_size=10, max_interval=60, on_stored=on_stored)
+    messages = [FakeMessage(1), FakeMessage(2), FakeMessage(3)]
+
+    async def run():
+        for message in messages:
+            await writer.add(message, {"n": message.delivery_tag})
+        await writer.flush()
+
+    asyncio.run(run())
+
+    assert stored == [{"n": 1}, {"n": 3}]
+    assert messages[2].acks == [True]
+    assert metrics.snapshot()["counters"]["ingest.partial.stored"] == 2
+
+
+def scopes_of_rollups(db):
+    return sorted(rollup["scope"] for rollup in db.payment_rollups.find({"granularity": "day"}))
+
+
+def test_payments_stored_before_their_offer_reach_the_provider_rollups():
+    db = mongomock.MongoClient().db
+    offer = {"id": 1, "timestamp": datetime(2024, 5, 1), "userid": "p1", "tags": ["food"]}
+
+    def payment(_id):
+        return {"_id": _id, "offer_id": 1, "amount": 10.0, "timestamp": datetime(2024, 5, 2, 12)}
+
+    # Stored before the offer, then adopted when it arrives
+    db.payments.insert_one(payment(1))
+    asyncio.run(store_payments(AsyncDatabase(db), [payment(1)]))
+    assert scopes_of_rollups(db) == ["global"]
+    asyncio.run(store_offers(AsyncDatabase(db), [offer]))
+
+    # Stored after the offer, but without it
+    db.payments.insert_one(payment(2))
+    asyncio.run(store_payments(AsyncDatabase(db), [payment(2)]))
+
+    assert scopes_of_rollups(db) == ["global", "provider:p1"]
+    assert [rollup["count"] for rollup in db.payment_rollups.find({"granularity": "day"}, sort=[("scope", 1)])] == [2, 2]
+    assert [payment["offer"] for payment in db.payments.find()] == [{"userid": "p1", "tags": ["food"]}] * 2
+
+
+def test_payments_are_not_updated_when_offers_cannot_be_embedded():
+    db = mongomock.MongoClient().db
+    db.offers_current.insert_one({"_id": 1, "userid": "p1", "tags": []})
+    payment = {"_id": 1, "offer_id": 1, "amount": 10.0, "timestamp": datetime(2024, 5, 2, 12)}
+    db.payments.insert_one(dict(payment))
+
+    asyncio.run(store_payments(AsyncDatabase(db), [payment], embed_offers=False))
+
+    assert "offer" not in db.payments.find_one()
+    assert scopes_of_rollups(db) == ["global"]
+
+
+class TimeseriesDatabase:
+    def __init__(self, version):
+        self.client = self
+        self.version = version
+
+    async def list_collections(self, filter):
+        return AsyncCursor([{"name": "payments", "type": "timeseries"}])
+
+    async def server_info(self):
+        return {"versionArray": self.version}
+
+
+def test_offers_are_embedded_in_timeseries_payments_from_mongodb_7():
+    assert asyncio.run(offers_embeddable(AsyncDatabase(mongomock.MongoClient().db)))
+    assert not asyncio.run(offers_embeddable(TimeseriesDatabase([6, 0, 14, 0])))
+    assert asyncio.run(offers_embeddable(TimeseriesDatabase([7, 0, 2, 0])))
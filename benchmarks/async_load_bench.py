@@ -0,0 +1,103 @@
+"""
+Throughput of the same dashboard aggregation served by a sync endpoint on
+the blocking pymongo client, which Starlette runs in its threadpool, and
+by an async endpoint on the motor repository, as the number of concurrent
+requests grows. Requests go through the ASGI app in process with httpx,
+on synthetic payments.
+
+    python -m benchmarks.async_load_bench [--payments 100000] [--requests 2000] [--concurrency 1 10 50 200]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi import FastAPI
+from pymongo import MongoClient
+
+from app.core.config import settings
+from app.db.init_db import client_options
+from app.db.repository import aggregate, repository
+
+PIPELINE = [
+    {"$group": {"_id": "$nationality", "num": {"$sum": 1}, "profit": {"$sum": "$amount"}}},
+]
+
+
+def seed(db, number):
+    db.payments.drop()
+    now = datetime.now()
+    for start in range(0, number, 10_000):
+        db.payments.insert_many([{
+            "offer_id": random.randint(0, 5000),
+            "amount": round(random.uniform(5, 200), 2),
+            "nationality": random.choice(["PT", "ES", "FR", "DE", "GB"]),
+            "timestamp": now - timedelta(minutes=random.randint(0, 60 * 24 * 365)),
+        } for _ in range(min(10_000, number - start))])
+
+
+def application(db) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/sync")
+    def sync_endpoint():
+        return list(db.payments.aggregate(PIPELINE))
+
+    @app.get("/async")
+    async def async_endpoint():
+        return await aggregate(repository.payments, PIPELINE)
+
+    return app
+
+
+async def load(client, path, requests, concurrency) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request():
+        async with semaphore:
+            response = await client.get(path)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def compare(db, requests, levels):
+    repository.connect(name=db.name)
+    transport = httpx.ASGITransport(app=application(db))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Opens the connections of both pools before measuring
+        await load(client, "/sync", 50, 50)
+        await load(client, "/async", 50, 50)
+
+        print(f"{'concurrency':>11} {'sync req/s':>12} {'async req/s':>12}")
+        for concurrency in levels:
+            sync = await load(client, "/sync", requests, concurrency)
+            asynchronous = await load(client, "/async", requests, concurrency)
+            print(f"{concurrency:>11} {sync:12.0f} {asynchronous:12.0f}")
+    repository.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 200])
+    args = parser.parse_args()
+
+    # Both clients with the pool settings of the API
+    client = MongoClient(str(settings.MONGO_URI), **client_options())
+    db = client[f"{settings.MONGO_DB}_bench"]
+    random.seed(0)
+    seed(db, args.payments)
+
+    asyncio.run(compare(db, args.requests, args.concurrency))
+
+    client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    main()
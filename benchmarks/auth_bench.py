@@ -0,0 +1,66 @@
+"""
+Requests per second of an endpoint behind verify_token, and token
+verifications per second, with the verified-token cache and without it.
+Dashboards send the same token with every request of a refresh.
+
+    python -m benchmarks.auth_bench [--requests 2000] [--tokens 1 10 100]
+"""
+import argparse
+import time
+
+from fastapi import FastAPI, Security
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.api import auth_deps
+from app.core.metrics import metrics
+
+
+def tokens(number):
+    now = int(time.time())
+    return [jwt.encode({
+        "sub": f"provider-{i}", "name": "Provider", "scopes": ["provider"], "tags": [], "type": "access",
+        "iat": now, "exp": now + 3600,
+    }, auth_deps.private_key, algorithm="RS256") for i in range(number)]
+
+
+def app():
+    bench = FastAPI()
+
+    @bench.get("/ping")
+    def ping(payload=Security(auth_deps.verify_token, scopes=["provider"])):
+        return payload.sub
+
+    return TestClient(bench)
+
+
+def rate(function, tokens, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        function(tokens[i % len(tokens)])
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+    client = app()
+
+    def request(token):
+        assert client.get("/ping", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+    print(f"{'tokens':>7} {'cache':>6} {'decode/s':>10} {'requests/s':>11} {'verify ms':>10}")
+    for number in args.tokens:
+        signed = tokens(number)
+        for size in (0, 4096):
+            auth_deps.verified_tokens = auth_deps.VerifiedTokens(size)
+            decodes = rate(auth_deps.decode_token, signed, args.requests)
+            requests = rate(request, signed, args.requests)
+            verify = metrics.snapshot()["timings"]["auth.verify"]["avg"] * 1000
+            print(f"{number:>7} {'on' if size else 'off':>6} {decodes:>10.0f} {requests:>11.0f} {verify:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Compares the throughput of the message decoding stage against the previous
+`eval(body.decode())` path.
+
+    python -m benchmarks.decode_bench
+"""
+import json
+import timeit
+
+from app.rabbitmq.decoding import decode_offer, decode_payment
+
+PAYMENT = json.dumps({
+    "offer_id": 1234,
+    "amount": 59.9,
+    "nationality": "PT",
+    "userid": "5f2b7c1e-7a4d-4a53-9d5e-3c1f9b1e2a77",
+    "timestamp": "2024-05-17T14:32:10.123456",
+}).encode()
+
+OFFER = json.dumps({
+    "id": 1234,
+    "userid": "9a7f1d2c-3b4e-4f5a-8b6c-7d8e9f0a1b2c",
+    "name": "Boat trip on the Ria de Aveiro",
+    "description": "One hour moliceiro trip through the canals",
+    "price": 15.0,
+    "tags": ["boat", "culture", "outdoor"],
+    "timestamp": "2024-05-17T14:32:10.123456",
+}).encode()
+
+NUMBER = 100_000
+
+
+def eval_decode(body: bytes):
+    return eval(body.decode())
+
+
+def main():
+    for name, body, decode in [("payment", PAYMENT, decode_payment), ("offer", OFFER, decode_offer)]:
+        legacy = timeit.timeit(lambda: eval_decode(body), number=NUMBER)
+        current = timeit.timeit(lambda: decode(body), number=NUMBER)
+        print(
+            f"{name:8} eval: {NUMBER / legacy:>10,.0f} msg/s   "
+            f"decoder: {NUMBER / current:>10,.0f} msg/s   "
+            f"speedup: {legacy / current:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Export throughput and peak RSS of every export format, against the paged
+JSON listing of /payments, on synthetic payments. Each run is done in its
+own process so the peak RSS of one doesn't hide the others.
+
+    python -m benchmarks.export_bench [--payments 500000]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import resource
+import time
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+from app.api.export import FORMATS, export_response
+from app.api.pagination import MAX_PAGE_SIZE, PageParams, paginate
+from app.core.config import settings
+
+
+def seed(db, number):
+    db.payments.drop()
+    now = datetime.now()
+    for start in range(0, number, 10_000):
+        db.payments.insert_many([{
+            "offer_id": random.randint(0, 5000),
+            "amount": round(random.uniform(5, 200), 2),
+            "nationality": random.choice(["PT", "ES", "FR", "DE", "GB"]),
+            "timestamp": now - timedelta(minutes=random.randint(0, 60 * 24 * 365)),
+            "offer": {"userid": f"provider-{random.randint(0, 50)}", "tags": ["boat", "culture"]},
+        } for _ in range(min(10_000, number - start))])
+
+
+async def drain(response) -> int:
+    size = 0
+    async for chunk in response.body_iterator:
+        size += len(chunk)
+    return size
+
+
+async def json_pages(collection) -> int:
+    # Following the X-Next-Cursor headers of /payments with the largest pages
+    size, cursor = 0, None
+    while True:
+        params = PageParams(limit=MAX_PAGE_SIZE, cursor=cursor, sort="_id", since=None, until=None, format="json")
+        response = await paginate(collection, {}, {"offer": 0}, params)
+        size += len(response.body)
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return size
+
+
+async def export(name, gzip) -> int:
+    collection = AsyncIOMotorClient(str(settings.MONGO_URI))[f"{settings.MONGO_DB}_bench"].payments
+    if name == "json pages":
+        return await json_pages(collection)
+    return await drain(await export_response(collection, "payments", name, gzip=gzip))
+
+
+def run(name, gzip, results):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    size = asyncio.run(export(name, gzip))
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    results.put((elapsed, size, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=500_000)
+    args = parser.parse_args()
+
+    client = MongoClient(str(settings.MONGO_URI))
+    db = client[f"{settings.MONGO_DB}_bench"]
+    random.seed(0)
+    seed(db, args.payments)
+
+    results = multiprocessing.Queue()
+    for name in ("json pages", *FORMATS):
+        for gzip in (False, True) if name != "json pages" else (False,):
+            process = multiprocessing.Process(target=run, args=(name, gzip, results))
+            process.start()
+            elapsed, size, peak = results.get()
+            process.join()
+            label = f"{name}{' + gzip' if gzip else ''}"
+            print(
+                f"{label:16} {args.payments / elapsed:10.0f} docs/s  {size / 2**20:8.1f} MB  "
+                f"peak RSS +{peak / 1024:7.1f} MB"
+            )
+
+    client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    main()
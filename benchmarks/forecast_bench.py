@@ -0,0 +1,69 @@
+"""
+Time to forecast the series of every provider one at a time with the
+previous two-slope heuristic in Python, against the batched NumPy
+forecasts, and the backtest accuracy of each on synthetic series.
+
+    python -m benchmarks.forecast_bench [--providers 1000 10000 50000] [--points 30]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from app.api.forecast import forecast
+
+HORIZON = 3
+REPEAT = 3
+
+
+def synthetic(series, points, seed=1):
+    rng = np.random.default_rng(seed)
+    t = np.arange(points + HORIZON)
+    level = rng.uniform(20, 200, (series, 1))
+    slope = rng.uniform(-1, 3, (series, 1))
+    values = level + slope * t + rng.normal(0, 1, (series, points + HORIZON)) * level * 0.1
+    return values[:, :points], values[:, points:]
+
+
+def two_slopes(values):
+    # get_prediction before the forecasting engine, once per series
+    slope1 = values[-2] - values[-3]
+    slope2 = values[-1] - values[-2]
+    average_slope = (slope1 + slope2) / 2
+    average_b = (values[-3] + (-slope2 + values[-2])) / 2
+    return [average_slope * i + average_b for i in range(3, 3 + HORIZON)]
+
+
+def timed(function):
+    best = math.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, np.asarray(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--providers", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--points", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'providers':>10} {'method':>12} {'seconds':>9} {'MAE':>8} {'coverage':>9}")
+    for providers in args.providers:
+        history, actual = synthetic(providers, args.points)
+        rows = history.tolist()
+
+        seconds, mean = timed(lambda: [two_slopes(row) for row in rows])
+        print(f"{providers:>10} {'two slopes':>12} {seconds:>9.4f} {np.abs(mean - actual).mean():>8.2f} {'-':>9}")
+
+        for method in ("linear", "holt"):
+            seconds, result = timed(lambda: forecast(history, HORIZON, method))
+            mean, lower, upper = result
+            covered = ((actual >= lower) & (actual <= upper)).mean()
+            print(f"{providers:>10} {method:>12} {seconds:>9.4f} {np.abs(mean - actual).mean():>8.2f} {covered:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compares the total_offers series of /analysis before and after the
+single-pass cumulative count, on a scratch copy of synthetic offers.
+
+Reports the number of aggregations sent to MongoDB (each one a full scan
+of the offers collection for the per-period implementation) and the time
+per call, and checks that both produce the same series.
+
+    python -m benchmarks.offer_totals_bench [--offers 20000]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from pymongo import MongoClient, monitoring
+
+from app.api import series
+from app.core.config import settings
+from app.db.offer_index import OFFER_INDEX_INDEXES, build_offer_index
+from app.db.repository import repository
+
+
+class AggregateCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name == "aggregate":
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def legacy_total_offers(offers_collection, boundaries_and_labels, date_format):
+    # The implementation being replaced: one aggregation per period
+    results = []
+    for boundary, label in boundaries_and_labels:
+        pipeline = [
+            {"$addFields": {"timestamp": {"$toDate": "$timestamp"}}},
+            {"$group": {"_id": "$id", "timestamp": {"$min": "$timestamp"}}},
+            {"$match": {"timestamp": {"$lt": boundary}}},
+            {"$count": "total"}
+        ]
+        result = list(offers_collection.aggregate(pipeline))
+        results.append({"count": result[0]['total'] if result else 0, "date": label})
+        results.sort(key=lambda result: datetime.strptime(result['date'], date_format))
+    return results
+
+
+def legacy_periods(x, now):
+    if x == "month":
+        months = [now - relativedelta(months=i) for i in range(-1, 11)]
+        return [(datetime(m.year, m.month, 1), (m - relativedelta(months=1)).strftime('%m/%Y')) for m in months], "%m/%Y"
+    if x == "day":
+        days = [now - timedelta(days=i) for i in range(-1, 29)]
+        return [(datetime(d.year, d.month, d.day), (d - timedelta(days=1)).strftime('%d/%m/%Y')) for d in days], "%d/%m/%Y"
+    # The per-period version used (hour + 1) % 24 as the boundary hour, which
+    # cut the 23:00 period at the start of the same day; compare against the
+    # intended boundary instead
+    hours = [now - timedelta(hours=i) for i in range(24)]
+    return [(datetime(h.year, h.month, h.day, h.hour) + timedelta(hours=1), h.strftime('%d/%m/%Y %H:00')) for h in hours], "%d/%m/%Y %H:%M"
+
+
+def seed(db, offers, now):
+    db.offers.drop()
+    db.offers_current.drop()
+    documents = []
+    for offer_id in range(offers):
+        created = now - timedelta(minutes=random.randint(0, 60 * 24 * 400))
+        for version in range(random.randint(1, 3)):
+            documents.append({
+                "id": offer_id,
+                "userid": f"provider-{offer_id % 50}",
+                "tags": random.sample(["beach", "food", "culture", "boat", "nature"], 2),
+                "timestamp": (created + timedelta(days=version)).isoformat(),
+            })
+    db.offers.insert_many(documents)
+    db.offers_current.create_indexes(OFFER_INDEX_INDEXES)
+    build_offer_index(db.offers)
+
+
+async def compare(db, counter, now):
+    # The series are read through the motor repository, like the API does
+    repository.connect(name=db.name, event_listeners=[counter])
+    for x in ("month", "day", "hour"):
+        periods, date_format = legacy_periods(x, now)
+
+        counter.count = 0
+        start = time.perf_counter()
+        legacy = legacy_total_offers(db.offers, periods, date_format)
+        legacy_time, legacy_scans = time.perf_counter() - start, counter.count
+
+        counter.count = 0
+        start = time.perf_counter()
+        current = await series.get_series("total_offers", x, now=now)
+        current_time, current_scans = time.perf_counter() - start, counter.count
+
+        print(
+            f"{x:6} per-period: {legacy_scans:3} aggregations {legacy_time * 1000:9.1f} ms   "
+            f"single pass: {current_scans:3} aggregations {current_time * 1000:7.1f} ms   "
+            f"same result: {legacy == current}"
+        )
+    repository.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--offers", type=int, default=20_000)
+    args = parser.parse_args()
+
+    counter = AggregateCounter()
+    client = MongoClient(str(settings.MONGO_URI), event_listeners=[counter])
+    db = client[f"{settings.MONGO_DB}_bench"]
+    now = datetime.now()
+    seed(db, args.offers, now)
+
+    asyncio.run(compare(db, counter, now))
+
+    client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares the regular and the time-series layouts of the payments
+collection on the same synthetic payments: storage and index size from
+collStats, and the latency of the dashboard queries that read payments,
+including the per-bucket totals behind the /analysis payment series.
+
+    python -m benchmarks.payments_storage_bench [--payments 200000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+from app.api import dmo
+from app.core.config import settings
+from app.db.indexes import INDEXES
+from app.db.init_db import PAYMENTS_TIMESERIES
+from app.db.repository import repository
+from app.db.rollups import _raw_totals
+
+
+def payments(number, now):
+    providers = [f"provider-{i}" for i in range(50)]
+    tags = ["beach", "food", "culture", "boat", "nature"]
+    for _ in range(number):
+        offer_id = random.randint(0, 5000)
+        yield {
+            "offer_id": offer_id,
+            "amount": round(random.uniform(5, 200), 2),
+            "nationality": random.choice(["PT", "ES", "FR", "DE", "GB"]),
+            "timestamp": now - timedelta(minutes=random.randint(0, 60 * 24 * 365)),
+            "offer": {"userid": providers[offer_id % 50], "tags": random.sample(tags, 2)},
+        }
+
+
+def seed(db, timeseries, number, now):
+    db.client.drop_database(db.name)
+    if timeseries:
+        db.create_collection("payments", timeseries=PAYMENTS_TIMESERIES)
+    db.payments.create_indexes(INDEXES["payments"])
+    # Both layouts store dates, so the pipelines don't convert timestamps
+    db.migrations.insert_one({"_id": "timestamps_to_dates:payments", "done": True})
+
+    batch = []
+    for payment in payments(number, now):
+        batch.append(payment)
+        if len(batch) == 10_000:
+            db.payments.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.payments.insert_many(batch, ordered=False)
+
+
+async def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def layouts(client, payments, repeat):
+    now = datetime.now()
+    # The endpoints without their result cache
+    queries = {
+        "profit this month": dmo.get_profit_this_month.__wrapped__,
+        "profit vs last month": dmo.get_profit_comparison_with_previous_month.__wrapped__,
+        "sales vs last month": dmo.get_number_of_sales_comparison_with_previous_month.__wrapped__,
+        "most consumed tags": dmo.get_most_consumed_tags.__wrapped__,
+        "last payments": dmo.get_last_payments.__wrapped__,
+    }
+    results = {}
+    for layout in ("regular", "timeseries"):
+        db = client[f"{settings.MONGO_DB}_bench_{layout}"]
+        seed(db, layout == "timeseries", payments, now)
+        repository.connect(name=db.name)
+
+        # Time-series sizes are reported for the bucket collection
+        stats = db.command("collStats", "payments")
+        results[layout] = {
+            "storage MB": stats["storageSize"] / 2**20,
+            "index MB": stats["totalIndexSize"] / 2**20,
+            **{name: await timed(lambda: query(payload=None), repeat) for name, query in queries.items()},
+            "analysis bucket totals": await timed(lambda: asyncio.to_thread(_raw_totals, db.payments), repeat),
+        }
+        repository.close()
+        client.drop_database(db.name)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    client = MongoClient(str(settings.MONGO_URI))
+    random.seed(0)
+    results = asyncio.run(layouts(client, args.payments, args.repeat))
+
+    print(f"{'':24} {'regular':>12} {'timeseries':>12}")
+    for name in results["regular"]:
+        unit = "" if name.endswith("MB") else " ms"
+        print(f"{name:24} {results['regular'][name]:9.1f}{unit:3} {results['timeseries'][name]:9.1f}{unit:3}")
+
+
+if __name__ == "__main__":
+    main()
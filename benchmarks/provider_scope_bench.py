@@ -0,0 +1,121 @@
+"""
+Latency of a provider dashboard query as the payments collection grows,
+for three ways of scoping the payments to a provider: joining every
+payment with its offer ($lookup, the original pipelines), matching the
+embedded offer.userid, and matching the ids of the provider's offers
+resolved from offers_current.
+
+    python -m benchmarks.provider_scope_bench [--sizes 10000 100000 500000] [--providers 200]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+from app.core.config import settings
+from app.db.indexes import INDEXES
+from app.db.provider_offers import ProviderOffers
+
+OFFERS_PER_PROVIDER = 20
+REPEAT = 5
+
+
+def seed(db, payments, providers, now):
+    db.client.drop_database(db.name)
+    for collection in ("offers", "payments", "offers_current"):
+        db[collection].create_indexes(INDEXES[collection])
+
+    offers = providers * OFFERS_PER_PROVIDER
+    db.offers.insert_many([
+        {"id": offer_id, "userid": f"provider-{offer_id % providers}", "timestamp": now}
+        for offer_id in range(offers)
+    ])
+    db.offers_current.insert_many([
+        {"_id": offer_id, "userid": f"provider-{offer_id % providers}", "first_seen": now, "last_seen": now}
+        for offer_id in range(offers)
+    ])
+    for start in range(0, payments, 10_000):
+        batch = []
+        for _ in range(min(10_000, payments - start)):
+            offer_id = random.randrange(offers)
+            batch.append({
+                "offer_id": offer_id,
+                "amount": round(random.uniform(5, 200), 2),
+                "timestamp": now - timedelta(minutes=random.randint(0, 60 * 24 * 90)),
+                "offer": {"userid": f"provider-{offer_id % providers}"},
+            })
+        db.payments.insert_many(batch, ordered=False)
+
+
+def profit_pipeline(scope, since):
+    return [
+        *scope,
+        {"$match": {"timestamp": {"$gte": since}}},
+        {"$group": {"_id": None, "profit": {"$sum": "$amount"}}},
+    ]
+
+
+async def timed(db, scope, since):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = await db.payments.aggregate(profit_pipeline(await scope(), since)).to_list(None)
+    # Sums may differ in the last digits with the order of the payments
+    return (time.perf_counter() - start) / REPEAT * 1000, [round(row["profit"], 2) for row in result]
+
+
+async def compare(db, motor_db, sizes, providers):
+    now = datetime.now()
+    since = datetime(now.year, now.month, 1)
+    uid = "provider-7"
+
+    async def lookup():
+        return [
+            {"$lookup": {"from": "offers", "localField": "offer_id", "foreignField": "id", "as": "offer"}},
+            {"$match": {"offer.userid": uid}},
+        ]
+
+    async def embedded():
+        return [{"$match": {"offer.userid": uid}}]
+
+    async def offer_ids():
+        # A fresh resolver per query, so the offer id lookup is included
+        return [await ProviderOffers().match(motor_db.offers_current, uid)]
+
+    scopes = {"$lookup": lookup, "embedded": embedded, "offer ids": offer_ids}
+
+    print(f"{'payments':>10} " + " ".join(f"{name:>12}" for name in scopes))
+    for size in sizes:
+        seed(db, size, providers, now)
+        timings, results = [], []
+        for scope in scopes.values():
+            elapsed, result = await timed(motor_db, scope, since)
+            timings.append(elapsed)
+            results.append(result)
+        same = all(result == results[0] for result in results)
+        print(f"{size:>10} " + " ".join(f"{elapsed:9.1f} ms" for elapsed in timings) + f"   same result: {same}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--providers", type=int, default=200)
+    args = parser.parse_args()
+
+    client = MongoClient(str(settings.MONGO_URI))
+    db = client[f"{settings.MONGO_DB}_bench"]
+    random.seed(0)
+
+    async def run():
+        motor_db = AsyncIOMotorClient(str(settings.MONGO_URI))[db.name]
+        await compare(db, motor_db, args.sizes, args.providers)
+
+    asyncio.run(run())
+    client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    main()
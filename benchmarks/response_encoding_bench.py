@@ -0,0 +1,70 @@
+"""
+Compares encoding a large result set as a response body through the
+json_util.dumps / json.loads round trip and JSONResponse against the
+single-pass MongoJSONResponse encoder, in time and peak memory.
+
+    python -m benchmarks.response_encoding_bench [--documents 100000]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId, json_util
+from fastapi.responses import JSONResponse
+
+from app.core.responses import MongoJSONResponse
+
+
+def payments(number):
+    start = datetime(2024, 1, 1)
+    return [{
+        "_id": ObjectId(),
+        "offer_id": random.randint(0, 5000),
+        "amount": round(random.uniform(5, 200), 2),
+        "nationality": random.choice(["PT", "ES", "FR", "DE", "GB"]),
+        "timestamp": start + timedelta(seconds=random.randint(0, 3600 * 24 * 365), microseconds=random.randint(0, 999999)),
+    } for _ in range(number)]
+
+
+def round_trip(documents):
+    return JSONResponse(json.loads(json_util.dumps(documents))).body
+
+
+def single_pass(documents):
+    return MongoJSONResponse(documents).body
+
+
+def measure(encode, documents):
+    start = time.perf_counter()
+    body = encode(documents)
+    elapsed = time.perf_counter() - start
+
+    # Memory in a second run, tracing slows the encoding down
+    tracemalloc.start()
+    encode(documents)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=100_000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    documents = payments(args.documents)
+
+    bodies = []
+    for name, encode in (("dumps/loads round trip", round_trip), ("single pass", single_pass)):
+        body, elapsed, peak = measure(encode, documents)
+        bodies.append(body)
+        print(f"{name:24} {elapsed * 1000:9.1f} ms  peak {peak / 2**20:7.1f} MB  body {len(body) / 2**20:6.1f} MB")
+    print(f"same body: {bodies[0] == bodies[1]}")
+
+
+if __name__ == "__main__":
+    main()